@@ -0,0 +1,113 @@
+"""Compare the streaming extractors with the full BeautifulSoup parse.
+
+Expects saved item pages under a fixtures directory, one subdirectory per
+page kind:
+
+    fixtures/lyrics/*.html   Genius song pages
+    fixtures/plots/*.html    Wikipedia film pages
+    fixtures/news/*.html     AP News articles
+
+e.g. ``curl -o fixtures/plots/dune.html https://en.wikipedia.org/wiki/Dune:_Part_Two``.
+For every page both paths are run, their output is checked to be identical
+and the time per page is reported.
+
+    python 1-Get/bench_parse.py fixtures --repeat 5
+"""
+import argparse
+import glob
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+from extract import extract_article, extract_lyrics, extract_plot
+
+
+# The extraction the scrapers did before extract.py, kept here as the baseline.
+def soup_lyrics(content):
+    soup = BeautifulSoup(content, "lxml")
+    lyrics_div = soup.find("div", {"data-lyrics-container": "true"})
+    return lyrics_div.text if lyrics_div else None
+
+
+def soup_plot(content):
+    soup = BeautifulSoup(content, "lxml")
+    try:
+        plot_section = soup.find("span", id="Plot").find_next("p")
+    except AttributeError:
+        return None
+    plot_text = plot_section.text
+    for sibling in plot_section.find_next_siblings():
+        if sibling.name == "p":
+            plot_text += "\n\n" + sibling.text
+        elif sibling.name == "h2":
+            break
+    return plot_text.strip()
+
+
+def soup_article(content):
+    soup = BeautifulSoup(content, "lxml")
+    title = soup.find("h1", class_="Page-headline")
+    authors = soup.find("div", class_="Page-authors")
+    article_body = soup.find("div", class_="RichTextStoryBody RichTextBody")
+    if not (title and article_body):
+        return None
+    paragraphs = [paragraph.text for paragraph in article_body.find_all("p", recursive=False)]
+    return title.text, authors.text if authors else None, paragraphs
+
+
+KINDS = {
+    "lyrics": (soup_lyrics, extract_lyrics),
+    "plots": (soup_plot, extract_plot),
+    "news": (soup_article, extract_article),
+}
+
+
+def time_per_page(fn, pages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in pages:
+            fn(content)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages)
+
+
+def bench_kind(kind, paths, repeat):
+    soup_fn, stream_fn = KINDS[kind]
+    pages = []
+    for path in paths:
+        with open(path, "rb") as file:
+            pages.append(file.read())
+
+    mismatches = 0
+    for path, content in zip(paths, pages):
+        if soup_fn(content) != stream_fn(content):
+            mismatches += 1
+            print(f"  output differs: {path}")
+
+    soup_time = time_per_page(soup_fn, pages, repeat)
+    stream_time = time_per_page(stream_fn, pages, repeat)
+    size = sum(len(content) for content in pages) / len(pages)
+    print(
+        f"{kind}: {len(pages)} pages, {size / 1024:.0f} KiB avg | "
+        f"BeautifulSoup {soup_time * 1000:.2f} ms/page | "
+        f"streaming {stream_time * 1000:.2f} ms/page | "
+        f"speedup {soup_time / stream_time:.1f}x | mismatches {mismatches}"
+    )
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming extraction against BeautifulSoup")
+    parser.add_argument("fixtures", help="Directory with lyrics/, plots/ and news/ subdirectories of saved pages")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per kind; the best one is reported")
+    args = parser.parse_args()
+
+    total_mismatches = 0
+    for kind in KINDS:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, kind, "*.html")))
+        if paths:
+            total_mismatches += bench_kind(kind, paths, args.repeat)
+    if total_mismatches:
+        raise SystemExit(f"{total_mismatches} pages produced different output")
@@ -0,0 +1,155 @@
+"""Streaming extraction of the content we keep from item pages.
+
+The scrapers only need one region of each lyrics, film and news page, so
+instead of building a full BeautifulSoup tree we feed the raw bytes to lxml's
+HTMLPullParser in chunks and stop as soon as that region has been consumed.
+Elements that end before the region are cleared as we go, so memory stays
+bounded by the part of the page we actually keep.
+
+Text is collected the way BeautifulSoup's ``get_text()`` does it (comments
+and the contents of script, style, template, rt and rp are skipped), so the
+files written from these extractors are identical to the ones written from
+the full tree.
+"""
+from bs4.dammit import EncodingDetector
+from lxml import etree
+
+CHUNK_SIZE = 16 * 1024
+SKIPPED_TEXT = {"script", "style", "template", "rt", "rp"}
+
+
+def element_text(element):
+    """Concatenated text of ``element`` and its descendants, as ``Tag.text`` gives it."""
+    parts = []
+    _collect_text(element, parts)
+    return "".join(parts)
+
+
+def _collect_text(element, parts):
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in SKIPPED_TEXT:
+            _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+def has_class(element, name):
+    """Match a ``class_=`` filter: any single class, or the whole class string."""
+    classes = (element.get("class") or "").split()
+    return name in classes or " ".join(classes) == name
+
+
+def iter_events(content):
+    """Yield (event, element) pairs while parsing ``content`` chunk by chunk.
+
+    The caller stops parsing simply by leaving the loop.
+    """
+    encoding = EncodingDetector.find_declared_encoding(content, is_html=True) or "utf-8"
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+    for start in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[start:start + CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _discard(element):
+    """Free an element nobody needs any more, keeping its tail for the parent's text."""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def extract_lyrics(content):
+    """Text of the first ``data-lyrics-container`` div, or None if the page has none."""
+    container = None
+    for event, element in iter_events(content):
+        if event == "start":
+            if container is None and element.tag == "div" and element.get("data-lyrics-container") == "true":
+                container = element
+        elif element is container:
+            return element_text(container)
+        elif container is None:
+            _discard(element)
+    return None
+
+
+def extract_plot(content):
+    """Text of the paragraphs that follow the "Plot" heading, up to the next h2.
+
+    Returns None if the page has no Plot section.
+    """
+    seen_heading = False
+    first = None
+    paragraphs = []
+    for event, element in iter_events(content):
+        if first is None:
+            if event == "start":
+                if not seen_heading:
+                    seen_heading = element.tag == "span" and element.get("id") == "Plot"
+                elif element.tag == "p":
+                    first = element
+            elif not seen_heading:
+                _discard(element)
+            continue
+        if event == "end" and element is first:
+            paragraphs.append(element_text(first))
+            continue
+        if not paragraphs:
+            continue
+        parent = first.getparent()
+        if element is parent:
+            break
+        if element.getparent() is not parent:
+            continue
+        if event == "start" and element.tag == "h2":
+            break
+        if event == "end" and element.tag == "p":
+            paragraphs.append(element_text(element))
+    if first is None or not paragraphs:
+        return None
+    return "\n\n".join(paragraphs).strip()
+
+
+def extract_article(content):
+    """Headline, byline and body paragraphs of an AP News article.
+
+    Returns ``(title, authors, paragraphs)`` with the raw element texts;
+    ``authors`` is None when the article has no byline and the whole result is
+    None when the headline or body is missing. Parsing stops at the end of the
+    story body, since the headline and byline come before it on every article
+    page.
+    """
+    title = authors = None
+    capturing = body = None
+    for event, element in iter_events(content):
+        if event == "start":
+            if body is not None or capturing is not None:
+                continue
+            if element.tag == "div" and has_class(element, "RichTextStoryBody RichTextBody"):
+                body = element
+            elif title is None and element.tag == "h1" and has_class(element, "Page-headline"):
+                capturing = element
+            elif authors is None and element.tag == "div" and has_class(element, "Page-authors"):
+                capturing = element
+            continue
+        if element is body:
+            if title is None:
+                return None
+            paragraphs = [element_text(child) for child in body if child.tag == "p"]
+            return title, authors, paragraphs
+        if body is not None:
+            continue
+        if element is capturing:
+            if element.tag == "h1":
+                title = element_text(element)
+            else:
+                authors = element_text(element)
+            capturing = None
+        if capturing is None:
+            _discard(element)
+    return None
@@ -0,0 +1,80 @@
+"""Shared HTTP fetch layer for the 1-Get scrapers.
+
+One ``requests.Session`` with pooled keep-alive connections and urllib3
+retries is shared by every request, a per-host semaphore keeps us polite to
+each site, and a single bounded thread pool runs all work. Scrapers describe
+their two-level crawl (index pages, then the items they link to) with
+``fan_out``, which submits item tasks from the calling thread so no pool
+worker ever blocks waiting on another.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class Fetcher:
+    def __init__(self, max_workers=16, per_host=8, retries=5, timeout=30):
+        retry_strategy = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=32, pool_maxsize=max_workers, max_retries=retry_strategy
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.per_host = per_host
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._host_slot(url):
+            response = self.session.get(url, **kwargs)
+            if not kwargs.get("stream"):
+                # read the body while holding the slot so the connection goes back to the pool
+                response.content
+            return response
+
+    def get_if_changed(self, url, manifest):
+        """Fetch ``url`` conditionally; return None if the manifest shows it unchanged."""
+        response = self.get(url, headers=manifest.conditional_headers(url))
+        if response.status_code == 304 or (
+            response.status_code == 200 and manifest.is_unchanged(url, response.content)
+        ):
+            return None
+        return response
+
+    def fan_out(self, index_fn, index_args, item_fn):
+        """Run ``index_fn`` over ``index_args`` and ``item_fn`` over every item they return.
+
+        ``index_fn`` returns a list of argument tuples for ``item_fn``. Items are
+        scheduled as soon as their index page is done, on the same pool.
+        """
+        index_futures = [self.executor.submit(index_fn, *args) for args in index_args]
+        item_futures = []
+        for future in as_completed(index_futures):
+            for item in future.result():
+                item_futures.append(self.executor.submit(item_fn, *item))
+        for future in as_completed(item_futures):
+            future.result()
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
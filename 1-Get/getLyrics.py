@@ -1,51 +1,37 @@
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from bs4 import BeautifulSoup
 
+from extract import extract_lyrics
+from fetcher import Fetcher
+from manifest import Manifest
+
+fetcher = Fetcher()
+manifest = None
+
 
 def get_song_lyrics(base_url, periods, songLyrics_folder):
     # Ensure the song lyrics directory exists
     os.makedirs(songLyrics_folder, exist_ok=True)
 
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for period in periods:
-            year, month = period
-            url = base_url.format(month, year)
-            futures.append(executor.submit(process_url, url, songLyrics_folder))
-
-        # Wait for all tasks to complete
-        for future in as_completed(futures):
-            future.result()
+    urls = [(base_url.format(month, year), songLyrics_folder) for year, month in periods]
+    fetcher.fan_out(process_url, urls, process_song)
 
 
 def process_url(url, songLyrics_folder):
+    """Return the (song_url, song_name, artist_name, folder) of every song on a calendar page."""
     soup = make_soup(url)
     links_div = soup.find("div", {"data-lyrics-container": "true"})
+    songs = []
     if links_div:
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for link in links_div.find_all("a"):
-                artist_name, song_name = get_artist_and_song_name(link)
-                futures.append(
-                    executor.submit(
-                        process_song,
-                        link.get("href"),
-                        song_name,
-                        artist_name,
-                        songLyrics_folder,
-                    )
-                )
-
-            # Wait for all tasks to complete
-            for future in as_completed(futures):
-                future.result()
+        for link in links_div.find_all("a"):
+            artist_name, song_name = get_artist_and_song_name(link)
+            songs.append((link.get("href"), song_name, artist_name, songLyrics_folder))
+    return songs
 
 
 def make_soup(url):
-    response = requests.get(url)
+    response = fetcher.get(url)
     return BeautifulSoup(response.content, "lxml")
 
 
@@ -56,12 +42,16 @@ def get_artist_and_song_name(link):
 
 
 def process_song(song_url, song_name, artist_name, songLyrics_folder):
-    song_soup = make_soup(song_url)
-    lyrics_div = song_soup.find("div", {"data-lyrics-container": "true"})
-    if lyrics_div:
-        lyrics = lyrics_div.text.strip()
+    response = fetcher.get_if_changed(song_url, manifest)
+    if response is None:
+        return  # unchanged since the last run
+    lyrics = extract_lyrics(response.content)
+    filepath = None
+    if lyrics is not None:
+        lyrics = lyrics.strip()
         filename = create_filename(artist_name, song_name)
-        write_lyrics(songLyrics_folder, filename, song_name, artist_name, lyrics)
+        filepath = write_lyrics(songLyrics_folder, filename, song_name, artist_name, lyrics)
+    manifest.record(song_url, response, filepath)
 
 
 def create_filename(artist_name, song_name):
@@ -77,6 +67,7 @@ def write_lyrics(folder, filename, song_name, artist_name, lyrics):
     filepath = os.path.join(folder, filename)
     with open(filepath, "w", encoding="utf-8") as file:
         file.write(f"{song_name} by {artist_name}\n\n{lyrics}")
+    return filepath
 
 
 if __name__ == "__main__":
@@ -94,5 +85,8 @@ if __name__ == "__main__":
         ("2023", "december"),
     ]
     songLyrics_folder = "a_files/song_lyrics"
+    manifest = Manifest(os.path.join(songLyrics_folder, ".manifest.sqlite"))
     get_song_lyrics(base_url, periods, songLyrics_folder)
+    fetcher.close()
+    manifest.close()
     print("Scraping complete!")
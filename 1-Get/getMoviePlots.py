@@ -1,82 +1,62 @@
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 from bs4 import BeautifulSoup
 
+from extract import extract_plot
+from fetcher import Fetcher
+from manifest import Manifest
+
+fetcher = Fetcher()
+manifest = None
+
 
 def fetch_movie_plots(base_url, periods, output_dir, small_plots_dir):
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(small_plots_dir, exist_ok=True)
 
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for year, section_ids in periods:
-            for section_id in section_ids:
-                url = base_url.format(year)
-                futures.append(
-                    executor.submit(
-                        process_section, url, section_id, output_dir, small_plots_dir
-                    )
-                )
-
-        for future in as_completed(futures):
-            future.result()
+    sections = [
+        (base_url.format(year), section_id, output_dir, small_plots_dir)
+        for year, section_ids in periods
+        for section_id in section_ids
+    ]
+    fetcher.fan_out(process_section, sections, fetch_and_save_plot)
 
 
 def process_section(url, section_id, output_dir, small_plots_dir):
+    """Return the (relative_url, movie_title, output_dir, small_plots_dir) of every film in a section."""
     soup = make_soup(url)
+    films = []
     try:
         section = soup.find("span", id=section_id).find_next("table")
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for row in section.find("tbody").find_all("tr"):
-                cells = row.find_all("td")
-                if cells:
-                    link = cells[0].find("a") or cells[1].find("a")
-                    if link and "href" in link.attrs:
-                        movie_title = link.text.strip()
-                        futures.append(
-                            executor.submit(
-                                fetch_and_save_plot,
-                                link["href"],
-                                movie_title,
-                                output_dir,
-                                small_plots_dir,
-                            )
-                        )
-
-            for future in as_completed(futures):
-                future.result()
+        for row in section.find("tbody").find_all("tr"):
+            cells = row.find_all("td")
+            if cells:
+                link = cells[0].find("a") or cells[1].find("a")
+                if link and "href" in link.attrs:
+                    movie_title = link.text.strip()
+                    films.append((link["href"], movie_title, output_dir, small_plots_dir))
     except AttributeError:
         print(f"Skipping section {section_id} due to missing table.")
+    return films
 
 
 def make_soup(url):
-    response = requests.get(url)
+    response = fetcher.get(url)
     return BeautifulSoup(response.content, "lxml")
 
 
 def fetch_and_save_plot(relative_url, movie_title, output_dir, small_plots_dir):
     movie_url = f"https://en.wikipedia.org{relative_url}"
-    movie_soup = make_soup(movie_url)
-    try:
-        plot_text = extract_plot_text(movie_soup)
-        if plot_text:
-            save_plot_text(plot_text, movie_title, output_dir, small_plots_dir)
-    except Exception as e:
+    response = fetcher.get_if_changed(movie_url, manifest)
+    if response is None:
+        return  # unchanged since the last run
+    plot_text = extract_plot(response.content)
+    file_path = None
+    if plot_text is None:
         print(f"No plot found for {movie_title}.")
-
-
-def extract_plot_text(soup):
-    plot_section = soup.find("span", id="Plot").find_next("p")
-    plot_text = plot_section.text
-    for sibling in plot_section.find_next_siblings():
-        if sibling.name == "p":
-            plot_text += "\n\n" + sibling.text
-        elif sibling.name == "h2":
-            break
-    return plot_text.strip()
+    elif plot_text:
+        file_path = save_plot_text(plot_text, movie_title, output_dir, small_plots_dir)
+    manifest.record(movie_url, response, file_path)
 
 
 def save_plot_text(plot_text, movie_title, output_dir, small_plots_dir):
@@ -85,6 +65,7 @@ def save_plot_text(plot_text, movie_title, output_dir, small_plots_dir):
     file_path = os.path.join(final_dir, filename)
     with open(file_path, "w", encoding="utf-8") as file:
         file.write(f"{movie_title}\n\n{plot_text}")
+    return file_path
 
 
 if __name__ == "__main__":
@@ -95,5 +76,8 @@ if __name__ == "__main__":
     ]
     output_dir = "a_files/movie_plots"
     small_plots_dir = "a_files/movie_plots_small"
+    manifest = Manifest(os.path.join(output_dir, ".manifest.sqlite"))
     fetch_movie_plots(base_url, periods, output_dir, small_plots_dir)
+    fetcher.close()
+    manifest.close()
     print("Scraping complete!")
@@ -0,0 +1,80 @@
+"""Scrape manifest for incremental, resumable runs of the 1-Get scrapers.
+
+Every fetched item page is recorded with its ETag, Last-Modified, a hash of
+its content and the file it was saved to. On the next run the fetcher sends
+conditional requests from these records and skips pages that come back 304
+or with identical content, so only new or changed pages are parsed and
+written. A page that produced no output file (its extraction failed) is
+fetched and parsed again on every run until it does. Index pages (category listings, calendars) are always fetched,
+since they are how new items are discovered.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class Manifest:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "content_hash TEXT, output_path TEXT, fetched_at REAL)"
+        )
+        self._conn.commit()
+
+    def _entry(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, output_path FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, digest, output_path = row
+        # a page without output (extraction failed) or whose output was deleted has to be processed again
+        if not output_path or not os.path.exists(output_path):
+            return None
+        return {"etag": etag, "last_modified": last_modified, "content_hash": digest}
+
+    def conditional_headers(self, url):
+        entry = self._entry(url)
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_unchanged(self, url, content):
+        entry = self._entry(url)
+        return entry is not None and entry["content_hash"] == content_hash(content)
+
+    def record(self, url, response, output_path=None):
+        """Remember a processed page; call once its output (if any) has been written."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    content_hash(response.content),
+                    output_path,
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
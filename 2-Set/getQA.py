@@ -1,13 +1,15 @@
 #getQA.py
 import asyncio
-import base64
 import os
+import sys
 
-import pdfplumber
 import requests
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from pdfminer.psparser import PSEOF  # Import the PSEOF exception
+from openai import APIError, AsyncOpenAI
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common import images, llm, telemetry
+from common.pdf_text import extract_text_from_pdf
 
 env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
 load_dotenv(env_path)
@@ -15,17 +17,14 @@ load_dotenv(env_path)
 client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-
 async def generate_description_from_image(image_path, max_retries=5, expected_count=5):
-    base64_image = encode_image(image_path)
+    # resized (and cached) off the event loop, so other files keep going meanwhile
+    base64_image = await asyncio.to_thread(images.encode_image, image_path)
     retries = 0
     while retries < max_retries:
         try:
-            response = await client.chat.completions.create(
+            response = await llm.acreate(
+                client,
                 model="gpt-4o",
                 messages=[
                     {
@@ -45,16 +44,18 @@ async def generate_description_from_image(image_path, max_retries=5, expected_co
                     }
                 ],
             )
-            mcqs_and_answers_content = response.choices[0].message.content
-            mcqs, answers = separate_mcqs_and_answers(mcqs_and_answers_content)
-            if len(answers) == expected_count and all(
-                answer in "ABCD" for answer in answers
-            ):
-                return mcqs, answers
-            else:
-                retries += 1
-        except Exception as e:
+        except APIError as e:
+            # throttling and transient failures were already retried by the rate limiter
             print(f"Error generating MCQs: {e}")
+            break
+        mcqs_and_answers_content = response.choices[0].message.content or ""
+        mcqs, answers = separate_mcqs_and_answers(mcqs_and_answers_content)
+        if len(answers) == expected_count and all(
+            answer in "ABCD" for answer in answers
+        ):
+            return mcqs, answers
+        else:
+            telemetry.record_parse_failure("gpt-4o")
             retries += 1
     print(f"Failed to generate valid MCQs after {max_retries} retries for {image_path}.")
     return "", ""
@@ -64,7 +65,8 @@ async def generate_mcq(context, plot, max_retries=5, expected_count=10):
     retries = 0
     while retries < max_retries:
         try:
-            response = await client.chat.completions.create(
+            response = await llm.acreate(
+                client,
                 model="gpt-3.5-turbo",
                 messages=[
                     {
@@ -74,16 +76,18 @@ async def generate_mcq(context, plot, max_retries=5, expected_count=10):
                     {"role": "user", "content": plot},
                 ],
             )
-            mcqs_and_answers_content = response.choices[0].message.content
-            mcqs, answers = separate_mcqs_and_answers(mcqs_and_answers_content)
-            if len(answers) == expected_count and all(
-                answer in "ABCD" for answer in answers
-            ):
-                return mcqs, answers
-            else:
-                retries += 1
-        except Exception as e:
+        except APIError as e:
+            # throttling and transient failures were already retried by the rate limiter
             print(f"Error generating MCQs: {e}")
+            break
+        mcqs_and_answers_content = response.choices[0].message.content or ""
+        mcqs, answers = separate_mcqs_and_answers(mcqs_and_answers_content)
+        if len(answers) == expected_count and all(
+            answer in "ABCD" for answer in answers
+        ):
+            return mcqs, answers
+        else:
+            telemetry.record_parse_failure("gpt-3.5-turbo")
             retries += 1
     print(f"Failed to generate valid MCQs after {max_retries} retries for {plot}.")
     return "", ""
@@ -107,23 +111,9 @@ def save_to_file(content, folder, filename):
         file.write(content)
 
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
-                if len(text) >= 1500:
-                    break
-    except PSEOF:  # Catch the PSEOF exception
-        print(
-            f"Encountered Unexpected EOF error for {filepath}, extracting available text"
-        )
-        pass  # Continue to the next line
-    return text[:1500]
-
-
 async def process_file(context, filepath, mcq_folder, answer_folder):
+    # gather runs every file in its own task, so the tags only apply to this file's calls
+    telemetry.set_tags(context=context, document=os.path.basename(filepath))
     filename = os.path.basename(filepath)
     base_filename = filename.rsplit(".", 1)[0]
     questions_filename = f"question_{base_filename}.md"
@@ -148,7 +138,7 @@ async def process_file(context, filepath, mcq_folder, answer_folder):
 
     # Process based on file type
     if filepath.endswith(".pdf"):
-        plot = extract_text_from_pdf(filepath)
+        plot = extract_text_from_pdf(filepath, verbose=True)
         expected_count = 10
     elif filepath.endswith((".jpg", ".jpeg")):  # Handle both .jpg and .jpeg
         mcqs, answers = await generate_description_from_image(
@@ -203,6 +193,8 @@ async def main():
             await process_directory(
                 context, context_folder, mcq_folder_base, answer_folder_base
             )
+    if images.stats.images:
+        print(f"Image payloads: {images.stats}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,16 @@
 # getStatic.py
 import asyncio
-import base64
 import os
+import sys
 
 import httpx
-import pdfplumber
 import PyPDF2
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from pdfminer.psparser import PSEOF
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common import images, llm, telemetry
+from common.pdf_text import extract_text_from_pdf
 
 env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
 load_dotenv(env_path)
@@ -24,27 +26,12 @@ instructions = {
 }
 
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
-                if len(text) >= 1500:
-                    break
-    except PSEOF:  # Catch the PSEOF exception
-        print(
-            f"Encountered Unexpected EOF error for {filepath}, extracting available text"
-        )
-        pass  # Continue to the next line
-    return text[:1500]
-
-
 async def generate_static(context, plot):
     inst = instructions[context]
 
     try:
-        response = await client.chat.completions.create(
+        response = await llm.acreate(
+            client,
             model="gpt-3.5-turbo",
             seed=123,
             temperature=0,
@@ -67,17 +54,13 @@ def save_to_file(content, folder, filename):
         file.write(content)
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-
 async def generate_description_from_image(context, image_path):
     inst = instructions[context]
-    base64_image = encode_image(image_path)
+    base64_image = await asyncio.to_thread(images.encode_image, image_path)
 
     try:
-        response = await client.chat.completions.create(
+        response = await llm.acreate(
+            client,
             model="gpt-4o",
             seed=123,
             temperature=0,
@@ -104,6 +87,8 @@ async def generate_description_from_image(context, image_path):
 
 
 async def process_file(context, filepath, static_folder):
+    # gather runs every file in its own task, so the tags only apply to this file's calls
+    telemetry.set_tags(context=context, document=os.path.basename(filepath))
     filename = os.path.basename(filepath)
     base_filename = filename.rsplit(".", 1)[0]
     static_filename = f"static_{base_filename}.md"
@@ -114,7 +99,7 @@ async def process_file(context, filepath, static_folder):
 
     # Process based on file type
     if filepath.endswith(".pdf"):
-        plot = extract_text_from_pdf(filepath)
+        plot = extract_text_from_pdf(filepath, verbose=True)
     elif filepath.endswith((".jpg", ".jpeg")):  # Handle both .jpg and .jpeg
         static_content = await generate_description_from_image(context, filepath)
         if static_content:
@@ -156,6 +141,8 @@ async def main():
         context_folder = os.path.join(root_folder, context)
         if os.path.isdir(context_folder):
             await process_directory(context, context_folder, static_folder_base)
+    if images.stats.images:
+        print(f"Image payloads: {images.stats}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,259 @@
+"""The four test conditions answered by quiz_engine.py.
+
+A condition says which sources a quiz is answered with and how its request is
+built from them:
+
+    s1  the questions alone
+    s2  the static lesson (d_static)
+    t1  the original document (a_files): markdown, PDF text or the image itself
+    t2  the original document and the static lesson
+
+The engine reads every source once per question file and hands the same
+``QuizFile`` to each condition. The prompts are the ones the per-condition
+scripts always sent, and every condition draws its attempt seeds from 123,
+the seed all four scripts actually ran with, so their answers and cached
+responses stay valid.
+"""
+import packing
+
+
+def model_for(context):
+    return "gpt-4o" if context == "images" else "gpt-3.5-turbo"
+
+
+def expected_answers_for(context):
+    return 5 if context == "images" else 10
+
+
+def image_message(questions, image_base64):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": questions},
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{image_base64}"
+                },
+            },
+        ],
+    }
+
+
+class Condition:
+    name = None
+    description = None
+    # sources read for this condition besides the questions
+    needs_original = False
+    needs_static = False
+    # whether build_packed_request is supported (see packing.py)
+    packable = False
+    max_retries = 3
+    # the scripts set 915 but never passed it through: s1, s2 and t1 handed it to max_retries
+    # by position and t2 dropped it, so every request was sent with the default of 123
+    seed = 123
+
+    def retries(self, quiz):
+        return self.max_retries
+
+    def build_request(self, quiz):
+        raise NotImplementedError
+
+    def build_packed_request(self, quizzes):
+        """One request answering several quizzes of the same context."""
+        raise NotImplementedError
+
+
+class QuestionsOnly(Condition):
+    name = "s1"
+    description = "Answer quizzes without any context (s1)"
+    packable = True
+
+    def build_request(self, quiz):
+        expected_answers = expected_answers_for(quiz.context)
+        return dict(
+            model=model_for(quiz.context),
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        f"You will be given a set of {expected_answers} multiple-choice questions regarding a {quiz.context}. "
+                        f"Please provide your answers in the following format:\n\n"
+                        f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                        f"OR\n\n"
+                        f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                        f"1) A\n2) B\n3) C\n...\n\n"
+                        f"Even if you feel you lack context, make an educated guess for each answer. You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats."
+                    ),
+                },
+                {"role": "user", "content": quiz.questions},
+            ],
+        )
+
+    def build_packed_request(self, quizzes):
+        context = quizzes[0].context
+        return packing.build_request(
+            model_for(context),
+            packing.instructions(len(quizzes), expected_answers_for(context), context),
+            [quiz.questions for quiz in quizzes],
+        )
+
+
+class StaticLesson(Condition):
+    name = "s2"
+    description = "Answer quizzes given the static lesson (s2)"
+    needs_static = True
+    packable = True
+    max_retries = 10
+
+    def build_request(self, quiz):
+        expected_answers = expected_answers_for(quiz.context)
+        return dict(
+            model=model_for(quiz.context),
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"You will be given a lesson on a specific topic. Please review the lesson carefully.\nLesson:{quiz.static_info}\n"
+                        f"You will be given a set of {expected_answers} multiple-choice questions regarding a {quiz.context}. "
+                        f"Please provide your answers in the following format:\n\n"
+                        f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                        f"OR\n\n"
+                        f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                        f"1) A\n2) B\n3) C\n...\n\n"
+                        f"Even if you feel you lack context, make an educated guess for each answer. You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats."
+                        f"Based on the discussion, please answer the following questions to evaluate your understanding.",
+                },
+                {"role": "user", "content": quiz.questions},
+            ],
+        )
+
+    def build_packed_request(self, quizzes):
+        """Each lesson goes next to its own questions."""
+        context = quizzes[0].context
+        blocks = [f"Lesson:{quiz.static_info}\n\nQuestions:\n{quiz.questions}" for quiz in quizzes]
+        return packing.build_request(
+            model_for(context),
+            packing.instructions(len(quizzes), expected_answers_for(context), context, with_lessons=True),
+            blocks,
+        )
+
+
+class OriginalInformation(Condition):
+    name = "t1"
+    description = "Answer quizzes given the original information (t1)"
+    needs_original = True
+
+    def retries(self, quiz):
+        return 10 if quiz.is_image else self.max_retries
+
+    def build_request(self, quiz):
+        if quiz.is_image:
+            return self.build_image_request(quiz)
+        expected_answers = expected_answers_for(quiz.context)
+        return dict(
+            model=model_for(quiz.context),
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        f"You will be given the original information of a {quiz.context} and a set of {expected_answers} multiple-choice questions based on it. "
+                        f"Please provide your answers in the following format:\n\n"
+                        f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                        f"OR\n\n"
+                        f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                        f"1) A\n2) B\n3) C\n...\n\n"
+                        f"You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats.\n\n"
+                        f"Original Information: {quiz.original_info}\n"
+                    ),
+                },
+                {"role": "user", "content": quiz.questions},
+            ],
+        )
+
+    def build_image_request(self, quiz):
+        expected_answers = 5
+        return dict(
+            model="gpt-4o",
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"You will be given the original information of an image and a set of {expected_answers} multiple-choice questions based on it. "
+                    f"Please provide your answers in the following format:\n\n"
+                    f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                    f"OR\n\n"
+                    f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                    f"1) A\n2) B\n3) C\n...\n\n"
+                    f"You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats.\n\n",
+                },
+                image_message(quiz.questions, quiz.image_base64),
+            ],
+        )
+
+
+class OriginalAndLesson(Condition):
+    name = "t2"
+    description = "Answer quizzes given the original information and static lesson (t2)"
+    needs_original = True
+    needs_static = True
+    max_retries = 10
+
+    def build_request(self, quiz):
+        if quiz.is_image:
+            return self.build_image_request(quiz)
+        expected_answers = expected_answers_for(quiz.context)
+        return dict(
+            model=model_for(quiz.context),
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        f"You will be given the original information and a brief lesson of a {quiz.context}, along with a set of {expected_answers} multiple-choice questions based on it. "
+                        f"Please provide your answers in the following format:\n\n"
+                        f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                        f"OR\n\n"
+                        f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                        f"1) A\n2) B\n3) C\n...\n\n"
+                        f"You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats.\n\n"
+                        f"Original Information: {quiz.original_info}\n\n"
+                        f"Lesson: {quiz.static_info}\n"
+                    ),
+                },
+                {"role": "user", "content": quiz.questions},
+            ],
+        )
+
+    def build_image_request(self, quiz):
+        expected_answers = 5
+        return dict(
+            model="gpt-4o",
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": f"You will be given the original information and a brief lesson of an image, along with a set of {expected_answers} multiple-choice questions based on it. "
+                            f"Please provide your answers in the following format:\n\n"
+                            f"1. A single string of {expected_answers} capital letters (A, B, C, or D) representing your choices for each question. For example: ABCDABCDAB\n\n"
+                            f"OR\n\n"
+                            f"2. A numbered list with the question number followed by a closing parenthesis or a dot, a space, and then the capital letter (A, B, C, or D) representing your choice. For example:\n"
+                            f"1) A\n2) B\n3) C\n...\n\n"
+                            f"You must provide exactly {expected_answers} answers, one for each question, and use only the specified formats.\n\n"
+                            f"Lesson: {quiz.static_info}\n",
+                        }
+                    ],
+                },
+                image_message(quiz.questions, quiz.image_base64),
+            ],
+        )
+
+
+CONDITIONS = {condition.name: condition for condition in (
+    QuestionsOnly(), StaticLesson(), OriginalInformation(), OriginalAndLesson()
+)}
@@ -0,0 +1,118 @@
+"""Local stand-in for the OpenAI Files and Batch endpoints.
+
+Implements just enough of the API for ``--batch`` runs of the quiz runners:
+uploading a JSONL input file, creating and retrieving a batch, and
+downloading its output file. Every batch completes immediately and each
+request is answered with a deterministic string of A-D letters, sized from
+the "set of N multiple-choice questions" phrase in its prompt.
+
+    python 3-Test/fake_batch_server.py --port 8089
+    OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=fake python 3-Test/s1.py --batch --poll-interval 1
+"""
+import argparse
+import hashlib
+import json
+import re
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+files = {}
+batches = {}
+
+expected_pattern = re.compile(r"set of (\d+) multiple-choice questions")
+
+
+def fake_answer(body):
+    prompt = json.dumps(body["messages"])
+    match = expected_pattern.search(prompt)
+    expected = int(match.group(1)) if match else 10
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return "".join("ABCD"[b % 4] for b in digest[:expected])
+
+
+def run_batch(input_file_id):
+    lines = []
+    for line in files[input_file_id].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = {
+            "id": f"chatcmpl-{request['custom_id']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["body"]["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": fake_answer(request["body"])},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+        lines.append(json.dumps({
+            "id": f"batch_req_{len(lines)}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": "", "body": body},
+            "error": None,
+        }))
+    return "\n".join(lines) + "\n", len(lines)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _send(self, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path == "/v1/files":
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = BytesParser(policy=HTTP).parsebytes(header + self._body())
+            part = next(p for p in message.iter_parts() if p.get_param("name", header="content-disposition") == "file")
+            file_id = f"file-{len(files)}"
+            files[file_id] = part.get_payload(decode=True)
+            self._send({"id": file_id, "object": "file", "bytes": len(files[file_id]),
+                        "created_at": int(time.time()), "filename": "batch.jsonl", "purpose": "batch",
+                        "status": "processed"})
+        elif self.path == "/v1/batches":
+            request = json.loads(self._body())
+            output, count = run_batch(request["input_file_id"])
+            batch_id = f"batch_{len(batches)}"
+            output_file_id = f"file-{len(files)}"
+            files[output_file_id] = output.encode("utf-8")
+            batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "completed", "output_file_id": output_file_id, "error_file_id": None,
+                "created_at": int(time.time()),
+                "request_counts": {"total": count, "completed": count, "failed": 0},
+            }
+            self._send(batches[batch_id])
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/batches/([\w-]+)", self.path)
+        if match and match.group(1) in batches:
+            self._send(batches[match.group(1)])
+            return
+        match = re.fullmatch(r"/v1/files/([\w-]+)/content", self.path)
+        if match and match.group(1) in files:
+            self._send(files[match.group(1)], "application/octet-stream")
+            return
+        self.send_error(404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI Batch API locally")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    print(f"Fake batch API listening on http://localhost:{args.port}/v1")
+    ThreadingHTTPServer(("localhost", args.port), Handler).serve_forever()
@@ -0,0 +1,120 @@
+"""Answer several independent quizzes with one chat completion.
+
+A packed request lists each quiz under a ``### QUIZ k ###`` header and asks
+for one answer line per quiz under the same header. ``unpack_answers`` splits
+the reply on those headers and parses each section with the runner's own
+``parse_answers``. A quiz whose section is missing, repeated or unparsable
+comes back as None, so the runner can answer it alone.
+
+``PackReport`` counts the calls saved. With ``--compare-unpacked`` it also
+measures how often packed answers match the single-quiz answers for the same
+quizzes, all of them or a sample, which tells whether packing changes the
+results.
+"""
+import re
+
+QUIZ_HEADER = "### QUIZ {} ###"
+header_pattern = re.compile(r"^\s*#+\s*QUIZ\s+(\d+)\s*#*\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+def instructions(n_quizzes, expected_answers, context, with_lessons=False):
+    lesson_note = (
+        "Each set comes with a lesson on its topic. Review that lesson carefully before answering the set. "
+        if with_lessons else ""
+    )
+    example = "\n".join(f"{QUIZ_HEADER.format(k)}\n{'ABCD' * (expected_answers // 4)}{'ABCD'[:expected_answers % 4]}"
+                        for k in range(1, min(n_quizzes, 2) + 1))
+    return (
+        f"You will be given {n_quizzes} independent sets of {expected_answers} multiple-choice questions regarding a {context}. "
+        f"Each set starts with a line of the form {QUIZ_HEADER.format('k')}. {lesson_note}"
+        f"Answer every set on its own, without using the other sets.\n\n"
+        f"Reply with one block per set, in order: the set's {QUIZ_HEADER.format('k')} line, followed by a single line of "
+        f"{expected_answers} capital letters (A, B, C, or D) representing your choices for that set's questions. For example:\n"
+        f"{example}\n\n"
+        f"Even if you feel you lack context, make an educated guess for each answer. You must provide exactly "
+        f"{expected_answers} answers for each of the {n_quizzes} sets, and use only the specified format."
+    )
+
+
+def build_request(model, instruction, blocks):
+    """A request asking ``instruction`` of the quiz ``blocks``, each under its own header."""
+    content = "\n\n".join(f"{QUIZ_HEADER.format(k)}\n{block}" for k, block in enumerate(blocks, start=1))
+    return dict(
+        model=model,
+        temperature=0,
+        messages=[
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": content},
+        ],
+    )
+
+
+def unpack_answers(raw_answers, n_quizzes, expected_answers, parse_answers):
+    """Answers of each quiz in a packed reply, None for any quiz that could not be recovered."""
+    headers = list(header_pattern.finditer(raw_answers))
+    sections = {}
+    for index, match in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(raw_answers)
+        number = int(match.group(1))
+        # a repeated header makes it ambiguous which block belongs to the quiz
+        sections[number] = None if number in sections else raw_answers[match.end():end].strip()
+    answers = []
+    for number in range(1, n_quizzes + 1):
+        section = sections.get(number)
+        parsed = parse_answers(section, expected_answers) if section else None
+        answers.append(parsed if parsed and len(parsed) == expected_answers else None)
+    return answers
+
+
+class PackReport:
+    def __init__(self):
+        self.quizzes = 0
+        self.packed_calls = 0
+        self.fallbacks = 0
+        self.compared = 0
+        self.exact_matches = 0
+        self.compared_questions = 0
+        self.matching_questions = 0
+
+    def add_pack(self, answers):
+        self.quizzes += len(answers)
+        self.packed_calls += 1
+        self.fallbacks += sum(answer is None for answer in answers)
+
+    def compare(self, packed, single):
+        if not packed or not single or len(packed) != len(single):
+            return
+        self.compared += 1
+        self.exact_matches += packed == single
+        self.compared_questions += len(packed)
+        self.matching_questions += sum(a == b for a, b in zip(packed, single))
+
+    def update(self, other):
+        for name, value in other.as_dict().items():
+            if name in vars(self):
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            "quizzes": self.quizzes,
+            "packed_calls": self.packed_calls,
+            "fallbacks": self.fallbacks,
+            "compared": self.compared,
+            "exact_matches": self.exact_matches,
+            "compared_questions": self.compared_questions,
+            "matching_questions": self.matching_questions,
+            "question_agreement": self.matching_questions / self.compared_questions if self.compared_questions else None,
+            "quiz_agreement": self.exact_matches / self.compared if self.compared else None,
+        }
+
+    def __str__(self):
+        text = (
+            f"{self.quizzes} quizzes in {self.packed_calls} packed calls, "
+            f"{self.fallbacks} answered alone after a parse mismatch"
+        )
+        if self.compared:
+            text += (
+                f"; against unpacked answers: {self.matching_questions / self.compared_questions:.1%} of questions "
+                f"and {self.exact_matches / self.compared:.1%} of quizzes agree ({self.compared} quizzes compared)"
+            )
+        return text
@@ -0,0 +1,523 @@
+"""Answer the quizzes of several test conditions from one pass over the corpus.
+
+    python 3-Test/quiz_engine.py --conditions s1 s2 t1 t2
+
+walks the question folder once. For each question file it works out which
+conditions (see conditions.py) still lack an answer, and reads the questions
+and the sources those conditions need exactly once: the static lesson, and the
+original markdown, PDF text or image. Every condition's request then goes
+through the process-wide rate limiter of common.llm. Answers are written to
+the usual ``<condition>_answers/<context>/.../<condition>_<name>.md`` files.
+s1.py, s2.py, t1.py and t2.py run the engine for their own condition.
+
+Live runs are a pipeline: the directory walk runs in a thread and feeds a
+queue of ``--queue-size`` question files, and ``--max-concurrency`` workers
+take files off it, read them, answer them and write the answers. The walk
+waits while the queue is full, so only the files being worked on are held in
+memory however large the corpus is. ``progress`` counts the files scanned
+and finished while the run goes on.
+
+``--batch`` submits the first attempt of every condition in one Batch API
+run. ``--pack-size`` answers several quizzes per call (see packing.py) for
+the conditions that support it, s1 and s2; the others are answered one quiz
+per call as usual. Packed runs are fed by the same bounded walk, and each
+pack is sent as soon as the walk has filled it.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import zlib
+from pathlib import Path
+
+import aiofiles
+import ujson
+from dotenv import load_dotenv
+from openai import APIError, AsyncOpenAI
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common import batch, images, llm, quiz_answers, telemetry
+from common.pdf_text import extract_text_from_pdf
+import packing
+from conditions import CONDITIONS, expected_answers_for
+
+# Load environment variables
+env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
+load_dotenv(env_path)
+
+# Initialize the OpenAI client with your API key
+client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+# one of quiz_answers.ANSWER_FORMATS, set from --answer-format
+answer_format = "regex"
+# looked up in this order next to each question file
+ORIGINAL_SUFFIXES = (".md", ".pdf", ".jpg")
+# question files the walk hands over per thread hop
+SCAN_CHUNK = 64
+
+
+class Progress:
+    """How far a live run is: question files found by the walk, and those the workers finished."""
+
+    def __init__(self):
+        self.scanned = 0
+        self.finished = 0
+        self.answered = 0
+        self.scanning = True
+
+    def __str__(self):
+        return (
+            f"{self.finished}/{self.scanned}{'+' if self.scanning else ''} question files done, "
+            f"{self.answered} condition answers requested"
+        )
+
+
+stats = {name: quiz_answers.AnswerStats() for name in CONDITIONS}
+progress = Progress()
+
+
+def attempt_seeds(seed):
+    # a generator of its own, so the shared module RNG (the rate limiter's jitter) is left alone
+    rng = random.Random(seed)
+    return [rng.randint(0, 1000) for _ in range(10)]
+
+
+def parse_answers(raw_answers, expected_answers):
+    return quiz_answers.parse_text(raw_answers, expected_answers, tolerant=answer_format != "regex")
+
+
+class QuizFile:
+    """A question file, the source files next to it, and their contents once loaded."""
+
+    def __init__(self, context, questions_path, relative_path, original_path=None, static_path=None):
+        self.context = context
+        self.questions_path = questions_path
+        # relative to the context's question folder
+        self.relative_path = relative_path
+        self.original_path = original_path
+        self.static_path = static_path
+        self.questions = None
+        self.original_info = None
+        self.image_base64 = None
+        self.static_info = None
+
+    @property
+    def name(self):
+        return self.relative_path.stem[9:]
+
+    @property
+    def expected_answers(self):
+        return expected_answers_for(self.context)
+
+    @property
+    def is_image(self):
+        return self.original_path is not None and self.original_path.suffix == ".jpg"
+
+    def missing_source(self, condition):
+        """Which source ``condition`` needs and this file lacks, or None."""
+        if condition.needs_original and self.original_path is None:
+            return "original information"
+        if condition.needs_static and not self.static_path.exists():
+            return "static information"
+        return None
+
+    def answers_path(self, answers_root, condition):
+        return answers_root / f"{condition.name}_answers" / self.context / self.relative_path.with_name(
+            f"{condition.name}_{self.name}.md"
+        )
+
+    async def load(self, conditions):
+        """Read the questions and the sources ``conditions`` use, each at most once."""
+        if self.questions is None:
+            async with aiofiles.open(self.questions_path, "r") as file:
+                self.questions = await file.read()
+        if any(condition.needs_static for condition in conditions) and self.static_info is None:
+            async with aiofiles.open(self.static_path, "r") as file:
+                self.static_info = await file.read()
+        if any(condition.needs_original for condition in conditions) and self.original_info is None \
+                and self.image_base64 is None:
+            if self.original_path.suffix == ".pdf":
+                self.original_info = await asyncio.to_thread(extract_text_from_pdf, self.original_path)
+            elif self.original_path.suffix == ".md":
+                async with aiofiles.open(self.original_path, "r") as file:
+                    self.original_info = await file.read()
+            else:
+                self.image_base64 = await asyncio.to_thread(images.encode_image, self.original_path)
+
+
+def find_original(original_dir, relative_path):
+    for suffix in ORIGINAL_SUFFIXES:
+        path = original_dir / relative_path.with_name(f"{relative_path.stem[9:]}{suffix}")
+        if path.exists():
+            return path
+    return None
+
+
+def iter_quiz_files(questions_base_dir, original_base_dir, static_base_dir, conditions):
+    """Yield (quiz, conditions) for every question file, with the conditions whose sources it has."""
+    for context in os.listdir(questions_base_dir):
+        context_questions_dir = questions_base_dir / context
+        if not context_questions_dir.is_dir():
+            continue
+        # a condition skips a whole context when the folder of a source it needs is missing
+        context_conditions = [
+            condition for condition in conditions
+            if (not condition.needs_original or (original_base_dir / context).is_dir())
+            and (not condition.needs_static or (static_base_dir / context).is_dir())
+        ]
+        if not context_conditions:
+            continue
+        for root, _, files in os.walk(context_questions_dir):
+            for file in files:
+                if not (file.startswith("question_") and file.endswith(".md")):
+                    continue
+                questions_path = Path(root) / file
+                relative_path = questions_path.relative_to(context_questions_dir)
+                quiz = QuizFile(
+                    context,
+                    questions_path,
+                    relative_path,
+                    find_original(original_base_dir / context, relative_path),
+                    static_base_dir / context / relative_path.with_name(f"static_{relative_path.stem[9:]}.md"),
+                )
+                usable = []
+                for condition in context_conditions:
+                    missing = quiz.missing_source(condition)
+                    if missing:
+                        print(f"Skipping {file} for {condition.name} due to missing {missing} file.")
+                    else:
+                        usable.append(condition)
+                if usable:
+                    yield quiz, usable
+
+
+async def is_answered(answers_path, expected_answers):
+    if not answers_path.exists():
+        return False
+    async with aiofiles.open(answers_path, "r") as file:
+        existing_answers = await file.read()
+    return len(existing_answers) == expected_answers and all(answer in "ABCD" for answer in existing_answers)
+
+
+async def prepare(quiz, conditions, answers_root):
+    """The (condition, answers_path) jobs of ``quiz`` still to answer, with their sources loaded."""
+    jobs = []
+    for condition in conditions:
+        answers_path = quiz.answers_path(answers_root, condition)
+        if not await is_answered(answers_path, quiz.expected_answers):
+            jobs.append((condition, answers_path))
+    if jobs:
+        await quiz.load([condition for condition, _ in jobs])
+    return jobs
+
+
+async def save_answers(answers_path, model_answers, expected_answers):
+    if model_answers and len(model_answers) == expected_answers:
+        Path(answers_path.parent).mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(answers_path, "w") as file:
+            await file.write(model_answers)
+
+
+def quiz_tags(condition, quiz):
+    return telemetry.tags(stage=condition.name, context=quiz.context, document=quiz.questions_path.name,
+                          seed=condition.seed)
+
+
+async def get_model_answers(condition, quiz):
+    expected_answers = quiz.expected_answers
+    request = quiz_answers.prepare_request(condition.build_request(quiz), expected_answers, answer_format)
+    max_retries = condition.retries(quiz)
+    retries = 0
+    raw_answers = None
+    seeds = attempt_seeds(condition.seed)
+    while retries < max_retries:
+        try:
+            response = await llm.acreate(client, seed=seeds.pop(), **request)
+        except APIError as e:
+            # throttling and transient failures were already retried by the rate limiter
+            print(f"Error: {e}")
+            break
+        raw_answers = (response.choices[0].message.content or "").strip()
+        model_answers = quiz_answers.parse_response(response, expected_answers, answer_format)
+        if model_answers:
+            stats[condition.name].record(retries + 1, True)
+            return model_answers
+        telemetry.record_parse_failure(request["model"])
+        retries += 1
+    print(
+        f"Failed to generate answers after {max_retries} retries for context: {quiz.questions[:50]}"
+    )
+    print(f"Invalid answers format: {raw_answers}")
+    stats[condition.name].record(retries, False)
+    return None
+
+
+async def answer_job(condition, quiz, answers_path):
+    with quiz_tags(condition, quiz):
+        model_answers = await get_model_answers(condition, quiz)
+    await save_answers(answers_path, model_answers, quiz.expected_answers)
+
+
+async def scan(quiz_files, queue, workers):
+    """Put the walk's (quiz, conditions) on ``queue``, then one None per worker."""
+    while True:
+        # the walk stats every source file, so it runs in a thread to keep the workers going
+        items = await asyncio.to_thread(list, itertools.islice(quiz_files, SCAN_CHUNK))
+        if not items:
+            break
+        for item in items:
+            progress.scanned += 1
+            # waits while the queue is full, which keeps the walk just ahead of the workers
+            await queue.put(item)
+    progress.scanning = False
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def worker(queue, answers_root, bar):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        quiz, conditions = item
+        jobs = await prepare(quiz, conditions, answers_root)
+        await asyncio.gather(*[answer_job(condition, quiz, answers_path) for condition, answers_path in jobs])
+        progress.finished += 1
+        progress.answered += len(jobs)
+        bar.total = progress.scanned if not progress.scanning else None
+        bar.set_postfix(scanned=progress.scanned, refresh=False)
+        bar.update()
+
+
+async def run_live(quiz_files, answers_root, max_concurrency=64, queue_size=None):
+    """Answer the question files with ``max_concurrency`` workers fed from a bounded queue."""
+    queue = asyncio.Queue(maxsize=queue_size or 2 * max_concurrency)
+    with tqdm(desc="Question files", unit="file") as bar:
+        await asyncio.gather(
+            scan(iter(quiz_files), queue, max_concurrency),
+            *[worker(queue, answers_root, bar) for _ in range(max_concurrency)],
+        )
+    print(progress)
+
+
+async def get_packed_answers(condition, quizzes):
+    """Answers of several quizzes from one call; None for any quiz whose block did not parse."""
+    request = condition.build_packed_request(quizzes)
+    try:
+        response = await llm.acreate(client, seed=attempt_seeds(condition.seed)[-1], **request)
+    except APIError as e:
+        print(f"Error: {e}")
+        return [None] * len(quizzes)
+    raw_answers = (response.choices[0].message.content or "").strip()
+    answers = packing.unpack_answers(raw_answers, len(quizzes), quizzes[0].expected_answers, parse_answers)
+    for _ in range(answers.count(None)):
+        telemetry.record_parse_failure(request["model"])
+    return answers
+
+
+def in_comparison(quiz, share):
+    """Whether ``quiz`` is among the ``share`` of packed quizzes also answered alone; the same ones on every run."""
+    return share >= 1 or zlib.crc32(f"{quiz.context}/{quiz.relative_path}".encode("utf-8")) / 2**32 < share
+
+
+async def process_pack(condition, pack, compare_unpacked=0):
+    """Answer a pack of (quiz, answers_path) with one call, falling back to single calls.
+
+    The ``compare_unpacked`` share of the quizzes is also answered alone, within
+    the pack's worker, to measure the agreement.
+    """
+    report = packing.PackReport()
+    with telemetry.tags(stage=condition.name, context=pack[0][0].context, seed=condition.seed):
+        answers = await get_packed_answers(condition, [quiz for quiz, _ in pack])
+    report.add_pack(answers)
+    for (quiz, answers_path), packed_answers in zip(pack, answers):
+        with quiz_tags(condition, quiz):
+            if packed_answers is None:
+                print(f"Packed answer unusable for {quiz.questions_path.name}, answering it alone")
+                model_answers = await get_model_answers(condition, quiz)
+            else:
+                model_answers = packed_answers
+                if compare_unpacked and in_comparison(quiz, compare_unpacked):
+                    report.compare(packed_answers, await get_model_answers(condition, quiz))
+        await save_answers(answers_path, model_answers, quiz.expected_answers)
+    return report
+
+
+async def prepare_ahead(queue, prepared, answers_root):
+    """Start preparing each file taken off ``queue`` and hand the tasks on in walk order, then None."""
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        quiz, conditions = item
+        # files are read concurrently, as far ahead of the packing as ``prepared`` holds
+        await prepared.put((quiz, asyncio.create_task(prepare(quiz, conditions, answers_root))))
+    await prepared.put(None)
+
+
+async def group_packs(prepared, work, pack_size, workers):
+    """Put packs of ``pack_size`` jobs per (condition, context), and the jobs of other conditions, on ``work``."""
+    packs = {}
+    while True:
+        item = await prepared.get()
+        if item is None:
+            break
+        quiz, jobs = item
+        for condition, answers_path in await jobs:
+            if not condition.packable:
+                await work.put((condition, [(quiz, answers_path)]))
+                continue
+            key = (condition, quiz.context)
+            packs.setdefault(key, []).append((quiz, answers_path))
+            if len(packs[key]) == pack_size:
+                await work.put((condition, packs.pop(key)))
+    # the last, partial pack of each (condition, context)
+    for (condition, _), pack in packs.items():
+        await work.put((condition, pack))
+    for _ in range(workers):
+        await work.put(None)
+
+
+async def pack_worker(work, reports, compare_unpacked):
+    while True:
+        item = await work.get()
+        if item is None:
+            return
+        condition, pack = item
+        if not condition.packable:
+            quiz, answers_path = pack[0]
+            await answer_job(condition, quiz, answers_path)
+            continue
+        report = await process_pack(condition, pack, compare_unpacked)
+        context_reports = reports.setdefault(condition.name, {})
+        context_reports.setdefault(pack[0][0].context, packing.PackReport()).update(report)
+
+
+async def run_packed(quiz_files, answers_root, max_concurrency=64, pack_size=4, compare_unpacked=0,
+                     queue_size=None):
+    """Pack the quizzes of each (condition, context) that supports it; the rest are answered alone.
+
+    The walk feeds a bounded queue as in run_live, and the jobs are grouped into
+    packs in walk order as they come off it, so a pack is sent as soon as it is
+    full and the same corpus always gives the same packs. ``max_concurrency``
+    workers answer the packs and the single jobs.
+    """
+    queue_size = queue_size or 2 * max_concurrency
+    queue = asyncio.Queue(maxsize=queue_size)
+    prepared = asyncio.Queue(maxsize=queue_size)
+    work = asyncio.Queue(maxsize=queue_size)
+    reports = {}
+    await asyncio.gather(
+        scan(iter(quiz_files), queue, 1),
+        prepare_ahead(queue, prepared, answers_root),
+        group_packs(prepared, work, pack_size, max_concurrency),
+        *[pack_worker(work, reports, compare_unpacked) for _ in range(max_concurrency)],
+    )
+    for name, context_reports in reports.items():
+        # packs finish in any order, so the contexts are sorted to keep the report stable
+        context_reports = dict(sorted(context_reports.items()))
+        for context, report in context_reports.items():
+            print(f"{name} {context}: {report}")
+        answers_dir = answers_root / f"{name}_answers"
+        answers_dir.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(answers_dir / "pack_report.json", "w") as file:
+            await file.write(ujson.dumps(
+                {context: report.as_dict() for context, report in context_reports.items()}, indent=4
+            ))
+
+
+async def run_batch(quiz_files, answers_root, poll_interval=60):
+    pending = {}
+    for quiz, conditions in quiz_files:
+        for condition, answers_path in await prepare(quiz, conditions, answers_root):
+            # the first attempt of get_model_answers, so live re-runs hit the cache
+            request = dict(condition.build_request(quiz), seed=attempt_seeds(condition.seed)[-1])
+            pending[f"{condition.name}-{quiz.context}-{len(pending)}"] = (condition, quiz, answers_path, request)
+
+    contents = await batch.run_batch(
+        client, {custom_id: item[3] for custom_id, item in pending.items()}, poll_interval
+    )
+    for custom_id, (condition, quiz, answers_path, _) in pending.items():
+        raw_answers = contents.get(custom_id)
+        model_answers = parse_answers(raw_answers.strip(), quiz.expected_answers) if raw_answers else None
+        if model_answers is None:
+            # fall back to the live retry loop for anything the batch could not answer
+            print(f"Batch answer unusable for {quiz.questions_path.name} ({condition.name}), retrying live")
+            with quiz_tags(condition, quiz):
+                model_answers = await get_model_answers(condition, quiz)
+        await save_answers(answers_path, model_answers, quiz.expected_answers)
+
+
+async def main(
+    condition_names, questions_base_dir, original_base_dir, static_base_dir, answers_root,
+    use_batch = False, poll_interval = 60, pack_size = 1, compare_unpacked = 0, max_concurrency = 64,
+    queue_size = None,
+):
+    conditions = [CONDITIONS[name] for name in condition_names]
+    quiz_files = iter_quiz_files(questions_base_dir, original_base_dir, static_base_dir, conditions)
+    print(f"Answering {', '.join(condition_names)} for {questions_base_dir}")
+    if use_batch:
+        await run_batch(quiz_files, answers_root, poll_interval)
+    elif pack_size > 1:
+        await run_packed(quiz_files, answers_root, max_concurrency, pack_size, compare_unpacked, queue_size)
+    else:
+        await run_live(quiz_files, answers_root, max_concurrency, queue_size)
+
+
+def cli(condition_names=None):
+    """Command line of the engine; the per-condition scripts fix ``condition_names``."""
+    global answer_format
+    description = (
+        CONDITIONS[condition_names[0]].description if condition_names and len(condition_names) == 1
+        else "Answer the quizzes of several test conditions from one pass over the corpus"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    if condition_names is None:
+        parser.add_argument("--conditions", nargs="+", default=list(CONDITIONS), choices=list(CONDITIONS))
+    parser.add_argument("--questions-dir", default="data/b_questions")
+    parser.add_argument("--original-dir", default="data/a_files", help="Original documents, used by t1 and t2")
+    parser.add_argument("--static-dir", default="data/d_static", help="Static lessons, used by s2 and t2")
+    parser.add_argument("--answers-root", default=".", help="Folder holding the <condition>_answers folders")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Number of workers answering question files at once")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="Question files the directory walk may queue ahead of the workers (defaults to twice the workers)")
+    parser.add_argument("--batch", action="store_true", help="Submit requests through the Batch API instead of live calls")
+    parser.add_argument("--poll-interval", type=int, default=60, help="Seconds between batch status checks")
+    parser.add_argument("--answer-format", choices=quiz_answers.ANSWER_FORMATS, default="regex",
+                        help="How answers are requested and parsed; structured forces a function call on live requests")
+    parser.add_argument("--pack-size", type=int, default=1,
+                        help="Answer this many quizzes per call in s1 and s2 (1 sends one quiz per call)")
+    parser.add_argument("--compare-unpacked", type=float, nargs="?", const=1.0, default=0.0, metavar="SHARE",
+                        help="Also answer this share of the packed quizzes alone (all of them if no share is given) and report the agreement")
+    args = parser.parse_args()
+    answer_format = args.answer_format
+    if args.batch and args.pack_size > 1:
+        parser.error("--pack-size cannot be combined with --batch")
+    if not 0 <= args.compare_unpacked <= 1:
+        parser.error("--compare-unpacked must be a share between 0 and 1")
+    condition_names = condition_names or args.conditions
+
+    asyncio.run(main(
+        condition_names,
+        Path(args.questions_dir),
+        Path(args.original_dir),
+        Path(args.static_dir),
+        Path(args.answers_root),
+        args.batch,
+        args.poll_interval,
+        args.pack_size,
+        args.compare_unpacked,
+        args.max_concurrency,
+        args.queue_size,
+    ))
+    for name in condition_names:
+        print(f"Answer parsing ({answer_format}) {name}: {stats[name]}")
+    if images.stats.images:
+        print(f"Image payloads: {images.stats}")
+
+
+if __name__ == "__main__":
+    cli()
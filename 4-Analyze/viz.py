@@ -1,14 +1,16 @@
 import base64
 import os
 import re
+import sys
 
 import matplotlib.pyplot as plt
 import pandas as pd
-import pdfplumber
 import PyPDF2
-from pdfminer.psparser import PSEOF  # Import the PSEOF exception
 from PIL import Image
 
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.pdf_text import extract_text_from_pdf
+
 
 def remove_illegal_chars(text):
     # Removes non-printable characters from a string
@@ -243,16 +245,7 @@ for folder in os.listdir(base_dir):
                     df_rows.append(row_data)  # Add row data for the current file
 
     def read_pdf_content(file_path, char_limit=1500):
-        text = ""
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text()
-                    if len(text) >= char_limit:
-                        break
-        except PSEOF:  # Catch the PSEOF exception
-            pass  # Continue to the next line
-        return text[:char_limit]
+        return extract_text_from_pdf(file_path, char_limit)
 
     def read_image_dimensions(file_path):
         try:
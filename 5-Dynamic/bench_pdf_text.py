@@ -0,0 +1,59 @@
+"""Throughput of the PDF text backends, serially and across a process pool.
+
+Runs every backend over a corpus of PDFs with the text cache disabled and
+reports pages/sec and files/sec. With the default ``--max-chars 0`` every
+page is extracted, which measures raw pages/sec; pass the stages' limit
+(1500) to measure files/sec for what get_all_data does at startup.
+
+    python 5-Dynamic/bench_pdf_text.py --corpus a_files/academic_papers --workers 8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+from pdfminer.pdfpage import PDFPage
+from pdfminer.psparser import PSEOF
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.pdf_text import BACKENDS, extract_texts
+
+
+def count_pages(filepath):
+    try:
+        with open(filepath, "rb") as file:
+            return sum(1 for _ in PDFPage.get_pages(file))
+    except PSEOF:
+        return 0
+
+
+def bench(filepaths, max_chars, backend, workers, pages):
+    start = time.perf_counter()
+    extract_texts(filepaths, max_chars=max_chars, backend=backend, max_workers=workers)
+    elapsed = time.perf_counter() - start
+    mode = "serial" if workers == 1 else f"{workers or os.cpu_count()} workers"
+    # with a char limit only the first pages are extracted, so pages/s would be meaningless
+    page_rate = f"{pages / elapsed:7.1f} pages/s | " if max_chars == sys.maxsize else ""
+    print(f"{backend:>10} | {mode:>10} | {elapsed:7.2f} s | {page_rate}{len(filepaths) / elapsed:6.2f} files/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF text extraction backends")
+    parser.add_argument("--corpus", default="a_files/academic_papers", help="Folder searched recursively for PDFs")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--max-chars", type=int, default=0, help="Char limit per file; 0 extracts whole documents")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (defaults to the CPU count)")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N PDFs")
+    args = parser.parse_args()
+
+    os.environ["PDF_TEXT_CACHE"] = "0"
+    filepaths = sorted(glob.glob(os.path.join(args.corpus, "**", "*.pdf"), recursive=True))[:args.limit]
+    if not filepaths:
+        raise SystemExit(f"No PDFs found under {args.corpus}")
+    max_chars = args.max_chars or sys.maxsize
+    pages = sum(count_pages(filepath) for filepath in filepaths)
+    print(f"{len(filepaths)} PDFs, {pages} pages, max_chars={args.max_chars or 'all'}")
+    for backend in args.backends:
+        bench(filepaths, max_chars, backend, 1, pages)
+        bench(filepaths, max_chars, backend, args.workers, pages)
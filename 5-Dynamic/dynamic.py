@@ -1,16 +1,20 @@
 import os
-from openai import OpenAI
-import json
+from openai import AsyncOpenAI
+import asyncio
 from dotenv import load_dotenv
-import re
-from utils import get_all_content, get_all_data
+from utils import get_all_content, iter_data, prefetch
+from nli import DEFAULT_MODEL as DEFAULT_NLI_MODEL, NLIClient, NLIScorer
+from results_store import ResultsStore, chat_history_path
 import argparse
 from typing import List, Dict
-from tqdm import tqdm
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForSeq2SeqLM
+from tqdm.asyncio import tqdm as tqdm_asyncio
 import torch
 import nltk
 import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common import images, llm, quiz_answers, telemetry
 
 nltk.data.path.append('.')
 
@@ -39,18 +43,25 @@ STUDENT_INSTRUCTIONS_MQ = {
 }
 
 QUESTION_SENTENCE = " Do you have any other questions?"
+# one of quiz_answers.ANSWER_FORMATS, set from --answer-format
+answer_format = "regex"
 
 #env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+
+async def create_chat_completion(**kwargs):
+    # per-model concurrency, rate limits and retries are handled by the shared limiter
+    return await llm.acreate(client, **kwargs)
 
-def get_answer_from_teacher(context: str, content: str, message_history: List[Dict], seed: int = 123):
+async def get_answer_from_teacher(context: str, content: str, message_history: List[Dict], seed: int = 123, usage=None):
     # to obtan answer from teacher, treat teacher as assistant and student as user
     new_history = list(map(lambda x: {"role": "user" if x["role"] == "student" else "assistant", 
                                           "content": x["content"]}, message_history))
     if context == 'images':
         instruction = TEACHER_INSTRUCTIONS[context]
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-4o", 
             messages=[{"role": "system", "content": instruction},
                        {"role": "user", "content": [{"type": "image_url", 
@@ -58,63 +69,49 @@ def get_answer_from_teacher(context: str, content: str, message_history: List[Di
                                                     }]
                        },
                       ] + new_history,
-            seed=seed)
+            seed=seed, usage=usage)
     else:
         instruction = TEACHER_INSTRUCTIONS[context].format(content=content)
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-3.5-turbo", 
             messages=[{"role": "system", "content": instruction}] + new_history,
-            seed=seed)
+            seed=seed, usage=usage)
     teacher_response = response.choices[0].message.content
 
     return teacher_response
 
-def get_question_from_student(context, message_history, seed: int = 123):
+async def get_question_from_student(context, message_history, seed: int = 123, usage=None):
     # to obtan question from student, treat student as assistant and teacher as user
     new_history = list(map(lambda x: {"role": "user" if x["role"] == "teacher" else "assistant", 
                                           "content": x["content"]}, message_history))
 
     instruction = STUDENT_INSTRUCTIONS[context]
-    response = client.chat.completions.create(
+    response = await create_chat_completion(
         model="gpt-3.5-turbo" if context != "images" else "gpt-4o",
         messages=[{"role": "system", "content": instruction}] + new_history,
-        seed=seed)
+        seed=seed, usage=usage)
     student_response = response.choices[0].message.content
 
     return student_response
 
 
-def get_refined_question_from_student(context, message_history, lesson, seed: int = 123):
-    def _get_entailment_score(model, tokenizer, sentences, question):
-        #inputs = tokenizer([(s, question) for s in sentences], padding=True, truncation=True, return_tensors='pt').to('cuda:0')
-        #label_mapping = ['contradiction', 'entailment', 'neutral']
-        #entailment_idx = label_mapping.index('entailment')
-        inputs = tokenizer([f"premise: {s} hypothesis: {question}" for s in sentences], 
-                           padding=True, truncation=True, return_tensors='pt')['input_ids'].to('cuda:0')
-        model.eval()
-        entailment_idx = tokenizer.convert_tokens_to_ids(['1'])[0]
-        
-        with torch.no_grad():
-            scores = nli_model.generate(inputs, max_new_tokens=1, return_dict_in_generate=True, output_scores=True).scores
-            #scores = model(**inputs).logits
-            total_score = torch.sum(scores[0][:, entailment_idx], dim=0).cpu().item()
-
-        return total_score
+async def get_refined_question_from_student(context, message_history, lesson, seed: int = 123, usage=None):
     # to obtan question from student, treat student as assistant and teacher as user
     new_history = list(map(lambda x: {"role": "user" if x["role"] == "teacher" else "assistant", 
                                           "content": x["content"]}, message_history))
 
     instruction = STUDENT_INSTRUCTIONS_MQ[context]
-    response = client.chat.completions.create(
+    response = await create_chat_completion(
         model="gpt-3.5-turbo" if context != "images" else "gpt-4o", 
         messages=new_history + [{"role": "user", "content": instruction}],
-        seed=seed)
+        seed=seed, usage=usage)
     student_response = response.choices[0].message.content
 
     questions = nltk.sent_tokenize(student_response)[:10] # split into questions
     
     lesson_sentences = nltk.sent_tokenize(lesson)
-    q_scores = [_get_entailment_score(nli_model, nli_tokenizer, lesson_sentences, q) for q in questions]
+    # all (lesson sentence, question) pairs are scored in one batched pass, off the event loop
+    q_scores = await asyncio.to_thread(nli_scorer.total_entailment, lesson_sentences, questions)
     print(questions)
     print(q_scores)
     print("------")
@@ -122,11 +119,13 @@ def get_refined_question_from_student(context, message_history, lesson, seed: in
     min_idx = torch.argmin(torch.tensor(q_scores)).item()
     return questions[min_idx]
 
-def eval_student(context, questions, message_history, true_answers, n_turn, provide_lesson: bool = False, seed: int = 123):
+async def eval_student(context, questions, message_history, true_answers, n_turn, provide_lesson: bool = False, seed: int = 123,
+                       usage=None):
     answer_list = None
     num_trials = 0
-    random.seed(seed)
-    seeds = [random.randint(0, 1000) for i in range(10)]
+    # local generator so concurrent conversations cannot interleave the seed sequence
+    rng = random.Random(seed)
+    seeds = [rng.randint(0, 1000) for i in range(10)]
     while answer_list is None:
         if num_trials > 9:
             break
@@ -146,10 +145,14 @@ def eval_student(context, questions, message_history, true_answers, n_turn, prov
                                           })
 
         expected_answers = 5 if context == "images" else 10
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo" if context != "images" else "gpt-4o",
+        model = "gpt-3.5-turbo" if context != "images" else "gpt-4o"
+        structured = quiz_answers.prepare_request({}, expected_answers, answer_format)
+        response = await create_chat_completion(
+            model=model,
             seed=seeds.pop(),
             temperature=0.0,
+            usage=usage,
+            **structured,
             messages=additional_system_msg + new_history + [{"role": "system",
                     "content": f"You will be given a set of {expected_answers} multiple-choice questions regarding a {context}. "
                             f"Please provide your answers in the following format:\n\n"
@@ -161,80 +164,121 @@ def eval_student(context, questions, message_history, true_answers, n_turn, prov
                             f"Based on the discussion, please answer the following questions to evaluate your understanding.",
                     }, {"role": "user", "content": questions}])
         
-        raw_answers = response.choices[0].message.content.strip()
-
-        # Precompiled regex patterns
-        continuous_pattern = re.compile(r"^[A-D]+$", re.MULTILINE)
-        listed_pattern = re.compile(r"^\d+\)\s*([A-D])\s*$", re.MULTILINE)
-        dot_pattern = re.compile(r"^\d+\.\s*([A-D])\s*$", re.MULTILINE)
-
-        continuous_match = continuous_pattern.search(raw_answers)
-        if continuous_match:
-            answer_list = continuous_match.group()
-        else:
-            # Combine listed and dot patterns
-            listed_matches = listed_pattern.findall(raw_answers) + dot_pattern.findall(raw_answers)
-            if len(listed_matches) == expected_answers:
-                answer_list = "".join(match.strip() for match in listed_matches)
+        answer_list = quiz_answers.parse_response(response, expected_answers, answer_format)
+        if answer_list is None:
+            telemetry.record_parse_failure(model)
         
         num_trials += 1
 
+    quiz_answers.stats.record(num_trials, answer_list is not None)
     if answer_list is None:
         return "NA", 0.0
     
     acc = sum(map(lambda x: x[0] == x[1], zip(answer_list, true_answers))) / len(true_answers)
     return answer_list, acc
 
-def run_conversation(context, content, questions, true_answers, static, out_dir, n_turn: int = 10, refine_questions=False, provide_lesson=False, seed:int = 123):
+async def run_conversation(context, content, questions, true_answers, static, out_dir, n_turn: int = 10, refine_questions=False, provide_lesson=False, seed:int = 123):
     lesson_txt = f"Here is the extensive summary of the {context.replace('_', ' ')}: {static}\n" if provide_lesson else ""
     msg_history = [{"role": "teacher", 
                     "content":  lesson_txt + f"You can ask me any question about the {context.replace('_', ' ')}."}]
+    # tokens billed per turn: the question and answer that produced it plus its quiz. Every prompt
+    # is its fixed instructions/content followed by the history so far, so turn i re-reads
+    # turn i-1's prompt as a prefix and the provider serves that part from its prompt cache
+    usage = [llm.TokenUsage() for _ in range(n_turn + 1)]
     
-    outputs = []
-    student_quiz_answers, acc = eval_student(context, questions, msg_history, true_answers, 0, provide_lesson, seed)
-    outputs.append((student_quiz_answers, acc))
-    
-    for i in range(1, n_turn + 1):
-        chat_summary = ' '.join([msg['content'].replace(QUESTION_SENTENCE, '') for msg in msg_history if msg['role'] == 'teacher'])
-        q =  get_refined_question_from_student(context, msg_history, chat_summary, seed) if refine_questions else get_question_from_student(context, msg_history, seed)
-        msg_history.append({"role": "student", "content": q})
-        answer = get_answer_from_teacher(context, content, msg_history, seed)
-        msg_history.append({"role": "teacher", "content": answer + QUESTION_SENTENCE})
-        student_quiz_answers, acc = eval_student(context, questions, msg_history, true_answers, i, provide_lesson, seed)
-        outputs.append((student_quiz_answers, acc))
-
-    return msg_history, outputs
-
-def run(context, n_turn, refine_questions, provide_lesson, questions_folder, answers_folder, 
-        context_folder, root_folder, static_folder, out_dir, seed: int = 123, results_folder: str = None):
-    data = get_all_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder)
-    results = []
-
-    for title, context, content, questions, answers, static_lesson in tqdm(data):
-        if results_folder:
-            if os.path.exists(os.path.join(results_folder, f'chat_history_{title}.json')):
-                continue
+    # quizzes only read a snapshot of the history, so each one runs in the background
+    # while the conversation moves on to the next question and answer
+    quiz_tasks = [asyncio.create_task(eval_student(context, questions, list(msg_history), true_answers, 0, provide_lesson, seed,
+                                                   usage=usage[0]))]
+    try:
+        for i in range(1, n_turn + 1):
+            chat_summary = ' '.join([msg['content'].replace(QUESTION_SENTENCE, '') for msg in msg_history if msg['role'] == 'teacher'])
+            if refine_questions:
+                q = await get_refined_question_from_student(context, msg_history, chat_summary, seed, usage=usage[i])
+            else:
+                q = await get_question_from_student(context, msg_history, seed, usage=usage[i])
+            msg_history.append({"role": "student", "content": q})
+            answer = await get_answer_from_teacher(context, content, msg_history, seed, usage=usage[i])
+            msg_history.append({"role": "teacher", "content": answer + QUESTION_SENTENCE})
+            quiz_tasks.append(asyncio.create_task(
+                eval_student(context, questions, list(msg_history), true_answers, i, provide_lesson, seed, usage=usage[i])))
+
+        outputs = list(await asyncio.gather(*quiz_tasks))
+    finally:
+        for task in quiz_tasks:
+            task.cancel()
+
+    return msg_history, outputs, usage
+
+async def run(context, n_turn, refine_questions, provide_lesson, questions_folder, answers_folder, 
+        context_folder, root_folder, static_folder, out_dir, seed: int = 123, results_folder: str = None,
+        max_concurrency: int = 16, prefetch_documents: int = 4, conversation_slots: asyncio.Semaphore = None):
+    # finished conversations are logged as they end, so a restart skips them without reading their chat files
+    store = ResultsStore(out_dir)
+
+    def _finished(title):
+        if store.is_done(title):
+            return True
+        return bool(results_folder) and os.path.exists(chat_history_path(results_folder, title))
+
+    # documents are read lazily in a background thread, a few ahead of the conversations
+    records = prefetch(iter_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder,
+                                 skip_title=_finished), prefetch_documents)
+    # bounds the number of conversations in flight; requests are further capped per model by the rate limiter.
+    # A sweep passes one semaphore to all of its runs so the bound is global
+    conversation_slots = conversation_slots or asyncio.Semaphore(max_concurrency)
+    total_usage = llm.TokenUsage()
+
+    async def _run_document(title, context, content, questions, answers, static_lesson):
+        # each document runs in its own task, so the tag only applies to this conversation's calls
+        telemetry.set_tags(document=title)
+        try:
+            print(title)
+            msg_history, outputs, usage = await run_conversation(context, content, questions, answers, static_lesson, out_dir, 
+                                                          n_turn, refine_questions, provide_lesson, seed)
+        finally:
+            conversation_slots.release()
+        for turn_usage in usage:
+            total_usage.update(turn_usage)
+        store.record(title, msg_history, [{'title': title, 'context': context, 'true_answer': answers,
+                                           'answers': student_answers, 'accuracy': acc, 'turn': i}
+                                          for i, (student_answers, acc) in enumerate(outputs)],
+                     usage=[turn_usage.as_dict() for turn_usage in usage])
+
+    tasks = []
+    titles = []
+    while True:
+        # wait for a free slot before loading the next document, so only the documents
+        # being talked about (plus the prefetched ones) are held in memory
+        await conversation_slots.acquire()
+        try:
+            record = await asyncio.to_thread(next, records, None)
+        except BaseException:
+            # a document that fails to load ends the run: give its slot back, which a sweep's other
+            # cells share, and stop this run's conversations instead of leaving them orphaned
+            conversation_slots.release()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if record is None:
+            conversation_slots.release()
+            break
+        title, context, content, questions, answers, static_lesson = record
         if len(answers) == 0:
+            conversation_slots.release()
             continue
-        print(title)
-        msg_history, outputs = run_conversation(context, content, questions, answers, static_lesson, out_dir, 
-                                                n_turn, refine_questions, provide_lesson, seed)
-        for i, output in enumerate(outputs):
-            student_answers, acc = output
-            results.append({'title': title, 'context': context, 'true_answer': answers, 'answers': student_answers, 
-                            'accuracy': acc, 'turn': i})
-        with open(os.path.join(out_dir, f'chat_history_{title}.json'), 'w') as f:
-            json.dump(msg_history, f, indent=4)
-    
-    res_file = os.path.join(out_dir, f'results.json')
-    if results_folder:
-        if os.path.exists(res_file):
-            with open(res_file, 'r') as f:
-                prev_results = json.load(res_file)
-                results.extend(prev_results)
-    
-    with open(res_file, 'w') as f:
-        json.dump(results, f, indent=4)
+        titles.append(title)
+        tasks.append(asyncio.create_task(_run_document(title, context, content, questions, answers, static_lesson)))
+
+    await tqdm_asyncio.gather(*tasks)
+
+    # this run's documents come first in document order, as in a sequential run, followed by earlier runs' results
+    store.write_results_json(first_titles=titles)
+    print(f"Token usage: {total_usage}")
+    print(f"Answer parsing ({answer_format}): {quiz_answers.stats}")
+    if images.stats.images:
+        print(f"Image payloads: {images.stats}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Set up dynamic conversation between student and teacher')
@@ -250,10 +294,27 @@ if __name__ == '__main__':
     parser.add_argument("--output-folder", required=True)
     parser.add_argument("--results-folder", required=False)
     parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--max-concurrency", type=int, default=16, help="Maximum number of conversations run at once")
+    parser.add_argument("--prefetch-documents", type=int, default=4, help="Number of documents loaded ahead of the running conversations")
+    parser.add_argument("--nli-model", default=DEFAULT_NLI_MODEL, help="T5 NLI checkpoint used by --refine-questions")
+    parser.add_argument("--nli-device", default=None, help="Device for the NLI model (defaults to cuda:0 when available, else cpu)")
+    parser.add_argument("--nli-quantize", action='store_true', help="Apply int8 dynamic quantization to the NLI model (CPU only)")
+    parser.add_argument("--nli-batch-size", type=int, default=16, help="Pairs per NLI forward pass")
+    parser.add_argument("--nli-server", default=None, help="Score on a running nli_server.py at this socket path or host:port instead of loading the model")
+    parser.add_argument("--max-requests-per-model", type=int, default=None, help="Maximum in-flight requests per model (defaults to the rate limiter's per-model limits)")
+    parser.add_argument("--answer-format", choices=quiz_answers.ANSWER_FORMATS, default="regex",
+                        help="How quiz answers are requested and parsed; structured forces a function call")
 
     args = parser.parse_args()
+    answer_format = args.answer_format
     print(args.static_folder)
-    if args.refine_questions:
-        nli_model = AutoModelForSeq2SeqLM.from_pretrained('google/t5_xxl_true_nli_mixture', device_map='cuda', torch_dtype=torch.bfloat16)
-        nli_tokenizer = AutoTokenizer.from_pretrained('google/t5_xxl_true_nli_mixture')
-    run(args.context, args.num_turns, args.refine_questions, args.provide_lesson, args.questions_folder, args.answers_folder, args.context_folder, args.root_folder, args.static_folder, args.output_folder, args.seed, args.results_folder)
+    telemetry.set_tags(context=args.context, seed=args.seed)
+    if args.refine_questions and args.nli_server:
+        nli_scorer = NLIClient(args.nli_server)
+    elif args.refine_questions:
+        nli_scorer = NLIScorer(args.nli_model, args.nli_device, args.nli_quantize, args.nli_batch_size)
+    if args.max_requests_per_model:
+        llm.get_rate_limiter().set_max_concurrency(args.max_requests_per_model)
+    asyncio.run(run(args.context, args.num_turns, args.refine_questions, args.provide_lesson, args.questions_folder, args.answers_folder, 
+                    args.context_folder, args.root_folder, args.static_folder, args.output_folder, args.seed, args.results_folder,
+                    args.max_concurrency, args.prefetch_documents))
@@ -1,103 +1,146 @@
 import glob
 from tqdm import tqdm
 import json
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForSeq2SeqLM
 import torch
 import nltk
 import argparse
 import os
-import pdfplumber
-from pdfminer.psparser import PSEOF
 import re
+import sys
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.pdf_text import extract_text_from_pdf
+from nli import DEFAULT_MODEL as DEFAULT_NLI_MODEL, NLIClient, NLIScorer
 
 nltk.data.path.append('.')
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
-                if len(text) >= 1500:
-                    break
-    except PSEOF:  # Catch the PSEOF exception
-        pass  # Continue to the next line
-    return text[:1500]
-
-def _get_entailment_scores(model, tokenizer, sentences, question, batch_size=16):
-    inputs = tokenizer([f"premise: {s} hypothesis: {question}" for s in sentences], 
-                        padding=True, truncation=True, return_tensors='pt')['input_ids'].to('cuda:0')
-    model.eval()
-    entailment_idx = tokenizer.convert_tokens_to_ids(['1'])[0]
-    non_entailment_idx = tokenizer.convert_tokens_to_ids(['0'])[0]
-    indices = [entailment_idx, non_entailment_idx]
-    
-    scores = []
-    with torch.no_grad():
-        for i in range(0, inputs.shape[0], 16):
-            batch = inputs[i:i+16, :]
-            batch_scores = nli_model.generate(batch, max_new_tokens=10, return_dict_in_generate=True, output_scores=True).scores[0]
-            batch_scores = torch.nn.functional.softmax(batch_scores[:, indices], dim=0).cpu()
-            scores.append(batch_scores)
-    
-    scores = torch.vstack(scores)
-    diff = (scores[:, 0] - scores[:, 1]).unsqueeze(-1)
-    
-    return diff
+def _get_entailment_scores(scorer, sentences, questions):
+    """Entailment margin of every doc sentence for each question sentence, as a [len(questions), len(sentences)] grid.
+
+    The whole grid goes through the scorer in one call. The softmax runs across each
+    block of 16 doc sentences (dim=0 of a block), as the scores have always been computed.
+    """
+    logits = scorer.pair_logits([(s, q) for q in questions for s in sentences])
+    logits = logits.view(len(questions), len(sentences), 2)
+    scores = torch.cat([torch.nn.functional.softmax(logits[:, i:i+16], dim=1) for i in range(0, len(sentences), 16)], dim=1)
+    return scores[..., 0] - scores[..., 1]
 
-def get_informativeness_per_doc(model, tokenizer, content, questions, split_by_newlines=False):
+def get_informativeness_per_doc(scorer, content, questions, split_by_newlines=False):
     doc_sentences =  content.split('\n') if split_by_newlines else nltk.sent_tokenize(content)
-    all_scores = []
+    question_sents = [nltk.sent_tokenize(q) for q in questions]
+    grid = _get_entailment_scores(scorer, doc_sentences, [sent for sents in question_sents for sent in sents])
+
     informativeness_per_doc = []
-    # aggregated informativenss: max_i(q_i, doc)
-    for q in questions:
-        sents = nltk.sent_tokenize(q)
-        sent_scores = []
-        # q_i vs doc: max_j entailment(q_ij, doc_sents)
-        for sent in sents:
-            scores = _get_entailment_scores(model, tokenizer, doc_sentences, sent)
-            sent_scores.append(scores)
-        scores = torch.max(torch.vstack(sent_scores), dim=-1).values
-        all_scores.append(scores)
-        max_of_qs = torch.max(torch.vstack(all_scores), dim=0).values
+    max_of_qs = None
+    start = 0
+    # aggregated informativenss: max_i(q_i, doc), kept as a running max over the questions so far
+    for sents in question_sents:
+        # q_i vs doc: the scores of all sentences of q_i against all doc sentences
+        scores = grid[start:start + len(sents)].reshape(-1)
+        start += len(sents)
+        max_of_qs = scores if max_of_qs is None else torch.maximum(max_of_qs, scores)
         informativeness_per_doc.append(max_of_qs.mean().item())
-    #informativeness_per_doc = all_scores #torch.vstack(all_scores)
     return informativeness_per_doc
 
-def get_informativeness(out_file, chat_directory, content_directory, questions_folder, role, model, tokenizer):
-    scores = {}
+def _list_documents(chat_directory, questions_folder, role):
     pattern = f"{questions_folder}/**/question_*.md" if role == 'quiz' else f"{chat_directory}/**/chat_*.json" 
-    
-    for file in tqdm(glob.glob(pattern, recursive=True)):
+    documents = []
+    for file in glob.glob(pattern, recursive=True):
         if role == 'quiz':
             doc_name = file.replace(f'{questions_folder}', '').replace('question_', '')
         else:
             doc_name = file.replace(f'{chat_directory}', '').replace('chat_history_', '').replace('.json', '')
-        
-        content_fname = os.path.join(content_directory, doc_name)
-        if 'academic_papers' in content_fname:
-            content_fname = content_fname.replace('.md', '.pdf')
-            content = extract_text_from_pdf(content_fname)
-        else:
-            with open(content_fname, 'rb') as f:
-                content = f.read().decode('utf-8')
-        
-        if role == 'quiz':
-            with open(file, 'r') as f:
-                txt = f.read()
-            questions = re.findall(r"Question [0-9]+: (.+)", txt, re.MULTILINE)
-        else:
-            with open(file, 'r') as f:
-                chat_history = json.load(f)
-            questions = [msg['content'] for msg in chat_history if msg['role'] == role]
+        documents.append((file, doc_name))
+    return documents
+
+def _score_document(file, doc_name, content_directory, role, scorer):
+    content_fname = os.path.join(content_directory, doc_name)
+    if 'academic_papers' in content_fname:
+        content_fname = content_fname.replace('.md', '.pdf')
+        content = extract_text_from_pdf(content_fname)
+    else:
+        with open(content_fname, 'rb') as f:
+            content = f.read().decode('utf-8')
+    
+    if role == 'quiz':
+        with open(file, 'r') as f:
+            txt = f.read()
+        questions = re.findall(r"Question [0-9]+: (.+)", txt, re.MULTILINE)
+    else:
+        with open(file, 'r') as f:
+            chat_history = json.load(f)
+        questions = [msg['content'] for msg in chat_history if msg['role'] == role]
+
+    split_by_lines = True if 'song_lyrics' in content_fname else False
+    return get_informativeness_per_doc(scorer, content, questions, split_by_lines)
+
+def checkpoint_path(out_file, shard_id, num_shards):
+    return f"{out_file}.shard-{shard_id}-of-{num_shards}.jsonl"
+
+def load_checkpoints(out_file):
+    """Scores of every document already written to any shard checkpoint of ``out_file``."""
+    scores = {}
+    for path in sorted(glob.glob(f"{glob.escape(out_file)}.shard-*-of-*.jsonl")):
+        with open(path, 'r') as f:
+            for line in f:
+                # a run killed mid-write can leave a partial last line behind
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                scores[record['doc']] = record['scores']
+    return scores
+
+def _drop_partial_line(path):
+    """Cut a partial last line off the checkpoint at ``path``, so the next record starts on a line of its own."""
+    with open(path, 'ab+') as f:
+        f.seek(0)
+        end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            end += len(line)
+        f.truncate(end)
 
-        split_by_lines = True if 'song_lyrics' in content_fname else False
-        informativeness_per_doc = get_informativeness_per_doc(model, tokenizer, content, questions, split_by_lines)
-        scores[doc_name] = informativeness_per_doc
+def shard_of(doc_name, num_shards):
+    return zlib.crc32(doc_name.encode('utf-8')) % num_shards
+
+def get_informativeness(out_file, chat_directory, content_directory, questions_folder, role, scorer,
+                        num_shards=1, shard_id=0):
+    """Score this shard's documents, appending each result to the shard's JSONL checkpoint.
+
+    Documents found in any existing checkpoint are skipped, so an interrupted run picks
+    up where it stopped. A single-shard run also writes ``out_file`` when it is done;
+    sharded runs are combined afterwards with ``merge_informativeness``.
+    """
+    # only this shard's checkpoint is repaired; the others may be written to by their own runs
+    _drop_partial_line(checkpoint_path(out_file, shard_id, num_shards))
+    done = load_checkpoints(out_file)
+    documents = [(file, doc_name) for file, doc_name in _list_documents(chat_directory, questions_folder, role)
+                 if shard_of(doc_name, num_shards) == shard_id and doc_name not in done]
+    print(f"Shard {shard_id}/{num_shards}: {len(documents)} documents to score, {len(done)} already scored")
+
+    with open(checkpoint_path(out_file, shard_id, num_shards), 'a') as checkpoint:
+        for file, doc_name in tqdm(documents):
+            informativeness_per_doc = _score_document(file, doc_name, content_directory, role, scorer)
+            checkpoint.write(json.dumps({'doc': doc_name, 'scores': informativeness_per_doc}) + '\n')
+            checkpoint.flush()
+
+    if num_shards == 1:
+        merge_informativeness(out_file, chat_directory, questions_folder, role)
+
+def merge_informativeness(out_file, chat_directory, questions_folder, role):
+    """Write ``out_file`` in its usual JSON format from all shard checkpoints."""
+    done = load_checkpoints(out_file)
+    documents = _list_documents(chat_directory, questions_folder, role)
+    scores = {doc_name: done[doc_name] for _, doc_name in documents if doc_name in done}
+    missing = len(documents) - len(scores)
+    if missing:
+        print(f"Warning: {missing} documents have not been scored yet")
 
     with open(out_file, 'w') as f:
         json.dump(scores, f, indent=4)
-    #torch.save(scores, out_file)
 
 
 if __name__ == '__main__':
@@ -107,9 +150,32 @@ if __name__ == '__main__':
     parser.add_argument("--questions-folder", required=False, help="Directory containing contents")
     parser.add_argument("--chat-folder", required=False, help="Directory containing chats")
     parser.add_argument("--output-file", required=True, help="Output file name")
+    parser.add_argument("--nli-model", default=DEFAULT_NLI_MODEL, help="T5 NLI checkpoint")
+    parser.add_argument("--nli-device", default=None, help="Device for the NLI model (defaults to cuda:0 when available, else cpu)")
+    parser.add_argument("--nli-quantize", action='store_true', help="Apply int8 dynamic quantization to the NLI model (CPU only)")
+    parser.add_argument("--nli-batch-size", type=int, default=16, help="Pairs per NLI forward pass")
+    parser.add_argument("--nli-server", default=None, help="Score on a running nli_server.py at this socket path or host:port instead of loading the model")
+    parser.add_argument("--num-shards", type=int, default=1, help="Split the documents into this many shards, one process each")
+    parser.add_argument("--shard-id", type=int, default=0, help="Shard scored by this process (0-based)")
+    parser.add_argument("--merge", action='store_true', help="Only merge the shard checkpoints into --output-file")
 
     args = parser.parse_args()
-    nli_model = AutoModelForSeq2SeqLM.from_pretrained('google/t5_xxl_true_nli_mixture', device_map='cuda', torch_dtype=torch.bfloat16)
-    nli_tokenizer = AutoTokenizer.from_pretrained('google/t5_xxl_true_nli_mixture')
+    if args.num_shards < 1:
+        parser.error("--num-shards must be at least 1")
+    if not 0 <= args.shard_id < args.num_shards:
+        parser.error(f"--shard-id must be between 0 and {args.num_shards - 1}")
+    if args.merge:
+        merge_informativeness(args.output_file, args.chat_folder, args.questions_folder, args.role)
+        sys.exit(0)
+
+    if args.nli_server:
+        # shards sharing a server all feed the one model
+        nli_scorer = NLIClient(args.nli_server)
+    else:
+        if args.num_shards > 1:
+            # split the cores between the shard processes instead of oversubscribing them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.num_shards))
+        nli_scorer = NLIScorer(args.nli_model, args.nli_device, args.nli_quantize, args.nli_batch_size)
 
-    get_informativeness(args.output_file, args.chat_folder, args.content_folder, args.questions_folder, args.role, nli_model, nli_tokenizer)
\ No newline at end of file
+    get_informativeness(args.output_file, args.chat_folder, args.content_folder, args.questions_folder, args.role, nli_scorer,
+                        args.num_shards, args.shard_id)
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""Batched entailment scoring with a T5 NLI checkpoint.
+
+The TRUE NLI models answer "premise: ... hypothesis: ..." with the token "1"
+(entailed) or "0" (not entailed), so the score of a pair is simply the logit
+of those tokens at the first decoder step. NLIScorer gets it from one plain
+forward pass per micro-batch instead of a ``generate`` call per hypothesis,
+sorts the pairs by length so the batches carry little padding, and runs on
+CPU (optionally with int8 dynamic quantization) when no GPU is around.
+
+The same document or lesson sentences are scored against many hypotheses,
+so premises are tokenized once and kept in an LRU cache; only the
+hypothesis side is tokenized per call. T5's SentencePiece vocabulary never
+merges across whitespace, so joining the two token runs gives exactly the
+ids of the joined text. Encoder states cannot be reused the same way: the
+encoder attends across premise and hypothesis, so every pair is encoded
+whole.
+
+NLIClient has the same interface but sends the pairs to an nli_server.py
+process, so any number of scripts and workers share one loaded model.
+Messages on the socket are length-prefixed JSON: ``{"pairs": [[premise,
+hypothesis], ...]}`` answered by ``{"logits": [[entail, non-entail], ...]}``
+or ``{"error": "..."}``.
+"""
+import functools
+import json
+import socket
+import struct
+import threading
+
+import torch
+
+DEFAULT_MODEL = 'google/t5_xxl_true_nli_mixture'
+MESSAGE_HEADER = struct.Struct('>I')
+
+
+class EntailmentScorer:
+    def pair_logits(self, pairs):
+        raise NotImplementedError
+
+    def total_entailment(self, premises, hypotheses):
+        """Sum of the entailment logits of every premise for each hypothesis."""
+        pairs = [(premise, hypothesis) for hypothesis in hypotheses for premise in premises]
+        logits = self.pair_logits(pairs)[:, 0].view(len(hypotheses), len(premises))
+        return logits.sum(dim=1).tolist()
+
+
+class NLIScorer(EntailmentScorer):
+    def __init__(self, model_name=DEFAULT_MODEL, device=None, quantize=False, batch_size=16, premise_cache_size=4096):
+        # imported here so that scripts using an NLIClient never pay for loading transformers
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+        self.device = device or ('cuda:0' if torch.cuda.is_available() else 'cpu')
+        self.batch_size = batch_size
+        on_gpu = self.device.startswith('cuda')
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(
+            model_name, torch_dtype=torch.bfloat16 if on_gpu else torch.float32).to(self.device)
+        if quantize:
+            if on_gpu:
+                raise ValueError("int8 dynamic quantization is only available on CPU")
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model.eval()
+
+        self.entailment_idx = self.tokenizer.convert_tokens_to_ids(['1'])[0]
+        self.non_entailment_idx = self.tokenizer.convert_tokens_to_ids(['0'])[0]
+        self.decoder_start_id = self.model.config.decoder_start_token_id
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+        self._premise_ids = functools.lru_cache(maxsize=premise_cache_size)(self._tokenize_premise)
+        # forward passes are serialized; callers run them in worker threads to keep the event loop free
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def format_pair(premise, hypothesis):
+        return f"premise: {premise} hypothesis: {hypothesis}"
+
+    def _tokenize_premise(self, premise):
+        return tuple(self.tokenizer(f"premise: {premise}", add_special_tokens=False)['input_ids'])
+
+    def encode_pairs(self, pairs):
+        """Token ids of ``format_pair`` for each pair, truncated and terminated like ``tokenizer(text)``."""
+        hypothesis_ids = {}
+        encoded = []
+        for premise, hypothesis in pairs:
+            if hypothesis not in hypothesis_ids:
+                hypothesis_ids[hypothesis] = self.tokenizer(f"hypothesis: {hypothesis}", add_special_tokens=False)['input_ids']
+            ids = list(self._premise_ids(premise)) + hypothesis_ids[hypothesis]
+            encoded.append(ids[:self.max_length - 1] + [self.tokenizer.eos_token_id])
+        return encoded
+
+    def _pad(self, encoded):
+        width = max(len(ids) for ids in encoded)
+        input_ids = torch.full((len(encoded), width), self.tokenizer.pad_token_id)
+        attention_mask = torch.zeros((len(encoded), width), dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            input_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+        return input_ids.to(self.device), attention_mask.to(self.device)
+
+    def pair_logits(self, pairs):
+        """First-step decoder logits of ("1", "0") for each (premise, hypothesis) pair, as an [N, 2] tensor."""
+        if not pairs:
+            return torch.empty((0, 2))
+        encoded = self.encode_pairs(pairs)
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        logits = torch.empty((len(encoded), 2))
+        with self._lock, torch.no_grad():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                input_ids, attention_mask = self._pad([encoded[i] for i in batch])
+                decoder_input_ids = torch.full((len(batch), 1), self.decoder_start_id, device=self.device)
+                step_logits = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                         decoder_input_ids=decoder_input_ids).logits[:, 0, :]
+                logits[batch] = step_logits[:, [self.entailment_idx, self.non_entailment_idx]].float().cpu()
+        return logits
+
+
+def parse_address(address):
+    """``host:port`` for TCP, anything else is a Unix socket path."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def send_message(sock, message):
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("NLI server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    (size,) = MESSAGE_HEADER.unpack(_recv_exactly(sock, MESSAGE_HEADER.size))
+    return json.loads(_recv_exactly(sock, size))
+
+
+class NLIClient(EntailmentScorer):
+    """Scores pairs on an nli_server.py process instead of a model of its own."""
+
+    def __init__(self, address):
+        self.family, self.address = parse_address(address)
+        # one connection per thread, so calls from worker threads reach the server together and get batched
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'sock', None) is None:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            sock.connect(self.address)
+            self._local.sock = sock
+        return self._local.sock
+
+    def pair_logits(self, pairs):
+        """First-step decoder logits of ("1", "0") for each (premise, hypothesis) pair, as an [N, 2] tensor."""
+        if not pairs:
+            return torch.empty((0, 2))
+        sock = self._connection()
+        try:
+            send_message(sock, {'pairs': [list(pair) for pair in pairs]})
+            reply = recv_message(sock)
+        except OSError:
+            sock.close()
+            self._local.sock = None
+            raise
+        if 'error' in reply:
+            raise RuntimeError(f"NLI server error: {reply['error']}")
+        return torch.tensor(reply['logits'], dtype=torch.float32)
@@ -0,0 +1,129 @@
+"""Serve one loaded NLI model to every script and worker on the machine.
+
+Clients (``nli.NLIClient``, selected with ``--nli-server`` in dynamic.py,
+eval_informativeness.py and sweep.py) send batches of (premise, hypothesis)
+pairs over a Unix or TCP socket. Requests that arrive while the model is busy,
+or within ``--max-wait-ms`` of each other, are merged into one
+``NLIScorer.pair_logits`` call of up to ``--max-batch-pairs`` pairs. That call
+sorts and micro-batches the pairs, so many small requests from parallel
+workers fill the same forward passes.
+
+    python 5-Dynamic/nli_server.py --socket .cache/nli.sock --nli-device cuda:0
+    python 5-Dynamic/eval_informativeness.py ... --nli-server .cache/nli.sock
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+
+from nli import DEFAULT_MODEL as DEFAULT_NLI_MODEL, MESSAGE_HEADER, NLIScorer, parse_address
+
+DEFAULT_SOCKET = os.path.join(os.path.dirname(__file__), "..", ".cache", "nli.sock")
+
+
+async def read_message(reader):
+    """The next message from ``reader``, or None once the client has disconnected."""
+    try:
+        (size,) = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def write_message(writer, message):
+    payload = json.dumps(message).encode("utf-8")
+    writer.write(MESSAGE_HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+class NLIServer:
+    def __init__(self, scorer, max_batch_pairs=512, max_wait=0.005):
+        self.scorer = scorer
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait
+        self.requests = asyncio.Queue()
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                result = loop.create_future()
+                await self.requests.put((message["pairs"], result))
+                try:
+                    reply = {"logits": await result}
+                except Exception as error:
+                    reply = {"error": repr(error)}
+                await write_message(writer, reply)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.requests.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_pairs:
+            try:
+                request = self.requests.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.requests.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    async def batch_loop(self):
+        while True:
+            batch = await self._next_batch()
+            pairs = [tuple(pair) for request_pairs, _ in batch for pair in request_pairs]
+            try:
+                # the forward passes run in a thread so new requests keep queuing up meanwhile
+                logits = await asyncio.to_thread(self.scorer.pair_logits, pairs)
+            except Exception as error:
+                for _, result in batch:
+                    result.set_exception(error)
+                continue
+            start = 0
+            for request_pairs, result in batch:
+                result.set_result(logits[start:start + len(request_pairs)].tolist())
+                start += len(request_pairs)
+
+    async def serve(self, address):
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(bind_address):
+                os.remove(bind_address)
+            os.makedirs(os.path.dirname(os.path.abspath(bind_address)), exist_ok=True)
+            server = await asyncio.start_unix_server(self.handle, bind_address)
+        else:
+            server = await asyncio.start_server(self.handle, *bind_address)
+        print(f"NLI server listening on {address}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.batch_loop())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an NLI model to dynamic.py and eval_informativeness.py")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path, or host:port to listen on TCP")
+    parser.add_argument("--nli-model", default=DEFAULT_NLI_MODEL, help="T5 NLI checkpoint to serve")
+    parser.add_argument("--nli-device", default=None, help="Device for the NLI model (defaults to cuda:0 when available, else cpu)")
+    parser.add_argument("--nli-quantize", action="store_true", help="Apply int8 dynamic quantization to the NLI model (CPU only)")
+    parser.add_argument("--nli-batch-size", type=int, default=16, help="Pairs per NLI forward pass")
+    parser.add_argument("--max-batch-pairs", type=int, default=512, help="Most pairs merged from concurrent requests into one scoring call")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="How long to wait for more requests before scoring a batch")
+    args = parser.parse_args()
+
+    scorer = NLIScorer(args.nli_model, args.nli_device, args.nli_quantize, args.nli_batch_size)
+    server = NLIServer(scorer, args.max_batch_pairs, args.max_wait_ms / 1000)
+    asyncio.run(server.serve(args.socket))
@@ -0,0 +1,102 @@
+"""Append-only store for the results of dynamic.py conversations.
+
+Each finished conversation is written out as soon as it ends: its chat
+history goes to ``chat_history_{title}.json`` (written to a temporary file
+and renamed into place, so a killed run never leaves a half-written history)
+and its per-turn results are appended as one line to ``results.jsonl`` and
+flushed. The log doubles as the index of completed titles, so a restarted run
+only reads the log to know what to skip. The tokens each turn used go to a
+separate ``usage.jsonl``, so the results keep their schema and do not depend
+on the state of the LLM cache.
+
+``write_results_json`` produces the usual ``results.json``: a flat list with
+one dict per (title, turn). An existing ``results.json`` from a run that
+predates the log is imported into it on first use.
+"""
+import json
+import os
+
+LOG_NAME = 'results.jsonl'
+RESULTS_NAME = 'results.json'
+USAGE_NAME = 'usage.jsonl'
+
+
+def chat_history_path(folder, title):
+    return os.path.join(folder, f'chat_history_{title}.json')
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ResultsStore:
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.log_path = os.path.join(out_dir, LOG_NAME)
+        self.usage_path = os.path.join(out_dir, USAGE_NAME)
+        os.makedirs(out_dir, exist_ok=True)
+        self._results = {}
+        if not os.path.exists(self.log_path):
+            self._import_results_json()
+        self._load()
+
+    def _load(self):
+        with open(self.log_path, 'ab+') as log:
+            log.seek(0)
+            end = 0
+            for line in log:
+                # a run killed mid-write can leave a partial last line behind
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._results[record['title']] = record['results']
+                end += len(line)
+            # drop it, so the next record starts on a line of its own
+            log.truncate(end)
+
+    def _import_results_json(self):
+        res_file = os.path.join(self.out_dir, RESULTS_NAME)
+        if not os.path.exists(res_file):
+            return
+        with open(res_file, 'r') as f:
+            previous = json.load(f)
+        by_title = {}
+        for row in previous:
+            by_title.setdefault(row['title'], []).append(row)
+        with open(self.log_path, 'w') as log:
+            for title, rows in by_title.items():
+                log.write(json.dumps({'title': title, 'results': rows}) + '\n')
+
+    def completed_titles(self):
+        return set(self._results)
+
+    def is_done(self, title):
+        return title in self._results
+
+    def record(self, title, msg_history, results, usage=None):
+        """Save one finished conversation: its chat history and per-turn usage first, then its line in the log."""
+        _write_atomic(chat_history_path(self.out_dir, title), msg_history)
+        if usage is not None:
+            with open(self.usage_path, 'a') as usage_log:
+                usage_log.write(json.dumps({'title': title, 'turns': usage}) + '\n')
+        with open(self.log_path, 'a') as log:
+            log.write(json.dumps({'title': title, 'results': results}) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+        self._results[title] = results
+
+    def results(self, first_titles=()):
+        """All results as a flat list; ``first_titles`` come first, in the given order, then the rest as logged."""
+        first_titles = [title for title in first_titles if title in self._results]
+        seen = set(first_titles)
+        ordered = first_titles + [title for title in self._results if title not in seen]
+        return [row for title in ordered for row in self._results[title]]
+
+    def write_results_json(self, first_titles=()):
+        _write_atomic(os.path.join(self.out_dir, RESULTS_NAME), self.results(first_titles))
@@ -1,11 +1,12 @@
 import argparse
+import asyncio
 from tqdm import tqdm
 import glob
 import json
 import os
 from dynamic import eval_student, TEACHER_INSTRUCTIONS
 
-def run(context, chat_folder, question_folder, answer_folder, provide_lesson, seed):
+async def run(context, chat_folder, question_folder, answer_folder, provide_lesson, seed):
     def _read_file(fname):
         with open(fname, "r") as f:
             return f.read()
@@ -24,7 +25,7 @@ def run(context, chat_folder, question_folder, answer_folder, provide_lesson, se
             chat_history = json.load(f)
         
         for i in range(1, len(chat_history) + 1, 2):
-            student_answers, acc = eval_student(context, questions, chat_history[:i], true_answers, i, provide_lesson, seed)
+            student_answers, acc = await eval_student(context, questions, chat_history[:i], true_answers, i, provide_lesson, seed)
             results.append({'title': title, 'context': context, 'true_answer': true_answers, 'answers': student_answers, 
                             'accuracy': acc, 'turn': (i-1)//2})
 
@@ -44,4 +45,4 @@ if __name__ == '__main__':
     parser.add_argument("--seed", type=int, default=123)
 
     args = parser.parse_args()
-    run(args.context, args.results_folder, args.questions_folder, args.answers_folder, args.provide_lesson, args.seed)
+    asyncio.run(run(args.context, args.results_folder, args.questions_folder, args.answers_folder, args.provide_lesson, args.seed))
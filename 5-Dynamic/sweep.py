@@ -0,0 +1,177 @@
+"""Run a grid of dynamic.py experiments in one process.
+
+Every (method, seed, context, subcategory) cell is one ``dynamic.run`` call,
+with the same folders and flags as the scripts/run*.sh loops. Cells run
+concurrently and share one process, so Python, transformers and the NLI
+model are loaded once. All LLM requests go through the one process-wide rate
+limiter, and one semaphore caps the conversations in flight across all cells.
+
+Progress is persisted at two levels. Each cell's output folder has its
+results log, so an interrupted cell resumes where it stopped. Finished cells
+are appended to ``sweep_state.jsonl`` under the output root, and a restarted
+sweep skips them without touching their folders.
+
+    python 5-Dynamic/sweep.py --methods plain w_lesson refinement --seeds 123 7 42
+
+Results go to ``<output-root>/results_dynamic_<method>/<context>[/<subcategory>]``
+as with the scripts, which run with the default seed 123. Any other seed gets
+a ``seed_<seed>`` folder after the method folder, so a cell's folder depends
+on the cell alone and matches its key in ``sweep_state.jsonl``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import dynamic
+from nli import DEFAULT_MODEL as DEFAULT_NLI_MODEL, NLIClient, NLIScorer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common import llm, quiz_answers, telemetry
+
+CONTEXTS = ["academic_papers", "images", "movie_plots", "news_articles", "song_lyrics"]
+SUBCATEGORIES = {
+    "news_articles": ["business", "entertainment", "oddities", "politics", "science", "sports", "us-news", "world-news"],
+    "academic_papers": ["cs", "econ", "eess", "math", "physics", "q-bio", "q-fin", "stat"],
+}
+METHODS = {
+    "plain": {"refine_questions": False, "provide_lesson": False},
+    "w_lesson": {"refine_questions": False, "provide_lesson": True},
+    "refinement": {"refine_questions": True, "provide_lesson": False},
+}
+STATE_NAME = "sweep_state.jsonl"
+# the seed of dynamic.py and the scripts, whose results have no seed folder
+DEFAULT_SEED = 123
+
+
+def cell_key(method, seed, context, subcategory):
+    return "/".join([method, str(seed), context] + ([subcategory] if subcategory else []))
+
+
+def build_cells(contexts, methods, seeds, subcategories=None):
+    """All (method, seed, context, subcategory) cells; subcategory is None for flat contexts."""
+    cells = []
+    for method in methods:
+        for seed in seeds:
+            for context in contexts:
+                subcats = (subcategories or SUBCATEGORIES).get(context) or [None]
+                cells.extend((method, seed, context, subcategory) for subcategory in subcats)
+    return cells
+
+
+def cell_folders(cell, data_folder, output_root):
+    method, seed, context, subcategory = cell
+    relative = os.path.join(context, subcategory) if subcategory else context
+    results_root = os.path.join(output_root, f"results_dynamic_{method}")
+    if seed != DEFAULT_SEED:
+        results_root = os.path.join(results_root, f"seed_{seed}")
+    return {
+        "context_folder": os.path.join(data_folder, "a_files", relative),
+        "questions_folder": os.path.join(data_folder, "b_questions", relative),
+        "answers_folder": os.path.join(data_folder, "c_answers", relative),
+        "static_folder": os.path.join(data_folder, "d_static", relative),
+        "out_dir": os.path.join(results_root, relative),
+    }
+
+
+def load_state(output_root):
+    """Keys of the cells a previous sweep finished."""
+    path = os.path.join(output_root, STATE_NAME)
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, "r") as f:
+        for line in f:
+            # a sweep killed mid-write can leave a partial last line behind
+            try:
+                done.add(json.loads(line)["cell"])
+            except json.JSONDecodeError:
+                continue
+    return done
+
+
+def mark_done(output_root, key):
+    with open(os.path.join(output_root, STATE_NAME), "a") as f:
+        f.write(json.dumps({"cell": key}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def run_sweep(cells, data_folder, root_folder, output_root, n_turn=5, max_concurrency=64, max_cells=8,
+                    prefetch_documents=4):
+    """Run every cell not finished by an earlier sweep; returns the keys of the cells that failed."""
+    os.makedirs(output_root, exist_ok=True)
+    done = load_state(output_root)
+    pending = [cell for cell in cells if cell_key(*cell) not in done]
+    print(f"{len(cells)} cells, {len(cells) - len(pending)} already done, {len(pending)} to run")
+
+    # one conversation bound for the whole sweep; each cell also holds a document loader
+    # while it runs, so only a few cells are started at a time
+    conversation_slots = asyncio.Semaphore(max_concurrency)
+    cell_slots = asyncio.Semaphore(max_cells)
+    progress = {"finished": 0}
+
+    async def _run_cell(cell):
+        method, seed, context, _ = cell
+        key = cell_key(*cell)
+        folders = cell_folders(cell, data_folder, output_root)
+        async with cell_slots:
+            telemetry.set_tags(stage=f"dynamic_{method}", context=context, seed=seed)
+            await dynamic.run(context, n_turn, METHODS[method]["refine_questions"], METHODS[method]["provide_lesson"],
+                              folders["questions_folder"], folders["answers_folder"], folders["context_folder"],
+                              root_folder, folders["static_folder"], folders["out_dir"], seed,
+                              prefetch_documents=prefetch_documents, conversation_slots=conversation_slots)
+        mark_done(output_root, key)
+        progress["finished"] += 1
+        print(f"[{progress['finished']}/{len(pending)}] finished {key}")
+
+    outcomes = await asyncio.gather(*[_run_cell(cell) for cell in pending], return_exceptions=True)
+    failed = []
+    for cell, outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            failed.append(cell_key(*cell))
+            print(f"Cell {cell_key(*cell)} failed: {outcome!r}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a grid of dynamic conversation experiments in one process")
+    parser.add_argument("--contexts", nargs="+", default=CONTEXTS, choices=CONTEXTS)
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=list(METHODS))
+    parser.add_argument("--seeds", nargs="+", type=int, default=[DEFAULT_SEED])
+    parser.add_argument("--subcategories", default=None,
+                        help='JSON overrides of the subcategories per context, e.g. {"news_articles": ["science"]}')
+    parser.add_argument("--num-turns", type=int, default=5)
+    parser.add_argument("--data-folder", default="data", help="Folder with a_files, b_questions, c_answers and d_static")
+    parser.add_argument("--root-folder", default=".")
+    parser.add_argument("--output-root", default="results")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Maximum number of conversations run at once across all cells")
+    parser.add_argument("--max-cells", type=int, default=8, help="Maximum number of cells run at once")
+    parser.add_argument("--prefetch-documents", type=int, default=4, help="Number of documents each cell loads ahead of its conversations")
+    parser.add_argument("--nli-model", default=DEFAULT_NLI_MODEL, help="T5 NLI checkpoint used by the refinement method")
+    parser.add_argument("--nli-device", default=None, help="Device for the NLI model (defaults to cuda:0 when available, else cpu)")
+    parser.add_argument("--nli-quantize", action="store_true", help="Apply int8 dynamic quantization to the NLI model (CPU only)")
+    parser.add_argument("--nli-batch-size", type=int, default=16, help="Pairs per NLI forward pass")
+    parser.add_argument("--nli-server", default=None, help="Score on a running nli_server.py at this socket path or host:port instead of loading the model")
+    parser.add_argument("--max-requests-per-model", type=int, default=None, help="Maximum in-flight requests per model (defaults to the rate limiter's per-model limits)")
+    parser.add_argument("--answer-format", choices=quiz_answers.ANSWER_FORMATS, default="regex",
+                        help="How quiz answers are requested and parsed; structured forces a function call")
+    args = parser.parse_args()
+    dynamic.answer_format = args.answer_format
+
+    subcategories = dict(SUBCATEGORIES)
+    if args.subcategories:
+        subcategories.update(json.loads(args.subcategories))
+    cells = build_cells(args.contexts, args.methods, args.seeds, subcategories)
+    # shared by every refinement cell
+    if "refinement" in args.methods and args.nli_server:
+        dynamic.nli_scorer = NLIClient(args.nli_server)
+    elif "refinement" in args.methods:
+        dynamic.nli_scorer = NLIScorer(args.nli_model, args.nli_device, args.nli_quantize, args.nli_batch_size)
+    if args.max_requests_per_model:
+        llm.get_rate_limiter().set_max_concurrency(args.max_requests_per_model)
+    failed = asyncio.run(run_sweep(cells, args.data_folder, args.root_folder, args.output_root, args.num_turns,
+                                   args.max_concurrency, args.max_cells, args.prefetch_documents))
+    if failed:
+        raise SystemExit(f"{len(failed)} cells failed: {', '.join(failed)}")
@@ -1,24 +1,12 @@
 import os
-import pdfplumber
-from pdfminer.psparser import PSEOF
+import queue
+import sys
+import threading
 from pathlib import Path
-import base64
-
-def extract_text_from_pdf(filepath):
-    text = ""
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
-                if len(text) >= 1500:
-                    break
-    except PSEOF:  # Catch the PSEOF exception
-        pass  # Continue to the next line
-    return text[:1500]
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from common.images import encode_image
+from common.pdf_text import extract_text_from_pdf, extract_texts
 
 def process_file(context, filepath,):
     # Extract text from PDF or read from Markdown file
@@ -45,29 +33,72 @@ def process_directory(context, folder, root_folder):
     
     return tasks
 
-def get_all_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder):
-    tasks = []
+def _load_document(context, context_folder, questions_folder, answers_folder, static_folder, root, file, title, content):
+    if content is None:
+        context, content = process_file(context, os.path.join(root, file))
+
+    static_path = os.path.join(root.replace(context_folder, static_folder), f'static_{title}')
+    _, static_lesson = process_file(context, static_path)
+
+    questions_path = os.path.join(root.replace(context_folder, questions_folder), f'question_{title}')
+    _ , questions = process_file(context, questions_path)
+
+    answers_path = os.path.join(root.replace(context_folder, answers_folder), f'answer_{title}')
+    _ , answers = process_file(context, answers_path)
+
+    return title, context, content, questions, answers, static_lesson
+
+def iter_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder,
+              skip_title=None, chunk_size=16):
+    """Yield (title, context, content, questions, answers, static_lesson) one document at a time.
+
+    Only file names are listed up front; ``skip_title(title)`` is checked before any
+    file of a document is read. PDFs are extracted ``chunk_size`` at a time across the
+    process pool of ``extract_texts``.
+    """
+    pending = []
     for root, dirs, files in os.walk(context_folder):
         for file in files:
-            context, content = process_file(context, os.path.join(root, file))
-
+            title = file
             if context == 'academic_papers':
-                file = file.replace('.pdf', '.md')
+                title = file.replace('.pdf', '.md')
             elif context == 'images':
-                file = file.replace('.jpg', '.md')
-            
-            static_path = os.path.join(root.replace(context_folder, static_folder), f'static_{file}')
-            _, static_lesson = process_file(context, static_path)
+                title = file.replace('.jpg', '.md')
+            if skip_title is not None and skip_title(title):
+                continue
+            pending.append((root, file, title))
 
-            questions_path = os.path.join(root.replace(context_folder, questions_folder), f'question_{file}')
-            _ , questions = process_file(context, questions_path)
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        pdf_texts = extract_texts([os.path.join(root, file) for root, file, _ in chunk if file.endswith(".pdf")])
+        for root, file, title in chunk:
+            yield _load_document(context, context_folder, questions_folder, answers_folder, static_folder,
+                                 root, file, title, pdf_texts.get(os.path.join(root, file)))
 
-            answers_path = os.path.join(root.replace(context_folder, answers_folder), f'answer_{file}')
-            _ , answers = process_file(context, answers_path)
+def prefetch(iterable, size):
+    """Iterate ``iterable`` in a background thread, keeping up to ``size`` items ready."""
+    items = queue.Queue(maxsize=size)
+    done = object()
 
-            tasks.append((file, context, content, questions, answers, static_lesson))
-    
-    return tasks
+    def _produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except BaseException as error:
+            items.put((None, error))
+        items.put((done, None))
+
+    threading.Thread(target=_produce, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+def get_all_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder):
+    return list(iter_data(context, context_folder, questions_folder, answers_folder, static_folder, root_folder))
 
 def get_all_content(context, context_folder, root_folder):
     return process_directory(context, context_folder, root_folder)
\ No newline at end of file
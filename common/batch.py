@@ -0,0 +1,102 @@
+"""Submit chat completion requests through the OpenAI Batch API.
+
+``run_batch`` turns a set of requests into a JSONL batch file, uploads and
+submits it, polls until the batch finishes and returns the message content
+of every request keyed by its custom id. Requests already in the response
+cache are answered without being submitted, and batch results are written
+back to the cache so a later live run reuses them.
+
+Point ``OPENAI_BASE_URL`` at ``3-Test/fake_batch_server.py`` to exercise the whole
+round trip locally.
+"""
+import asyncio
+import json
+
+from common import llm
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_BATCH = 50000
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_file(requests):
+    """Serialize ``{custom_id: request}`` into the Batch API JSONL input format."""
+    lines = [
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": request})
+        for custom_id, request in requests.items()
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def parse_batch_output(text):
+    """Map each custom id in a batch output file to its response body, or None on error."""
+    bodies = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            bodies[record["custom_id"]] = response["body"]
+        else:
+            error = record.get("error") or response.get("body", {}).get("error")
+            print(f"Batch request {record['custom_id']} failed: {error}")
+            bodies[record["custom_id"]] = None
+    return bodies
+
+
+async def _submit_and_wait(client, requests, poll_interval):
+    batch_input = await client.files.create(
+        file=("batch.jsonl", build_batch_file(requests).encode("utf-8")), purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_input.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+    while batch.status not in FINAL_STATUSES:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"Batch {batch.id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+
+    if batch.status != "completed":
+        print(f"Batch {batch.id} finished with status {batch.status}")
+    bodies = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            content = await client.files.content(file_id)
+            bodies.update(parse_batch_output(content.text))
+    return bodies
+
+
+async def run_batch(client, requests, poll_interval=60):
+    """Run ``{custom_id: request}`` through the Batch API.
+
+    Returns ``{custom_id: message content}``; requests that failed or did not
+    finish map to None.
+    """
+    contents = {}
+    pending = {}
+    for custom_id, request in requests.items():
+        cached = llm.cached_response(request)
+        if cached is not None:
+            contents[custom_id] = cached.choices[0].message.content
+        else:
+            pending[custom_id] = request
+    if contents:
+        print(f"{len(contents)} of {len(requests)} requests answered from the cache")
+
+    items = list(pending.items())
+    for start in range(0, len(items), MAX_REQUESTS_PER_BATCH):
+        chunk = dict(items[start:start + MAX_REQUESTS_PER_BATCH])
+        bodies = await _submit_and_wait(client, chunk, poll_interval)
+        for custom_id, request in chunk.items():
+            body = bodies.get(custom_id)
+            if body is None:
+                contents[custom_id] = None
+                continue
+            llm.store_response(request, body)
+            contents[custom_id] = body["choices"][0]["message"]["content"]
+    return contents
@@ -0,0 +1,206 @@
+"""Image payloads for the vision calls of every stage, downscaled and cached.
+
+``encode_image`` returns the base64 JPEG sent in an ``image_url`` data URL.
+Images whose longer side exceeds ``max_side`` pixels are shrunk to it and
+re-encoded at ``quality``. Smaller ones keep their original bytes unless
+re-encoding makes them smaller, and files Pillow cannot decode are sent as
+they are. Payloads are cached in a SQLite file keyed by the hash of the
+image's bytes and both parameters, so each image is resized once per corpus
+however many stages, seeds and conditions send it.
+
+gpt-4o scales every image to fit 2048x2048 and then its shorter side to 768
+before tiling it, so a ``max_side`` of 1024 leaves the tokens of ordinary
+photos unchanged and mostly saves upload bytes and latency. Very wide or tall
+images, and smaller values of ``max_side``, also cost fewer image tokens.
+``stats`` counts the bytes and estimated image tokens saved in this process.
+
+Environment variables:
+    IMAGE_MAX_SIDE    longest side in pixels (default 1024); 0 sends the original files unchanged
+    IMAGE_QUALITY     JPEG quality of re-encoded images (default 85)
+    IMAGE_CACHE       set to 0 to disable the cache
+    IMAGE_CACHE_PATH  location of the SQLite cache file
+"""
+import base64
+import hashlib
+import io
+import math
+import os
+import sqlite3
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "images.sqlite")
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_QUALITY = 85
+
+_cache = None
+
+
+def image_tokens(width, height):
+    """Estimated gpt-4o high-detail tokens of a ``width`` x ``height`` image."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+# the most a high-detail image can cost: 2048x768 after gpt-4o's rescaling, 4x2 tiles
+MAX_IMAGE_TOKENS = image_tokens(2048, 768)
+LOW_DETAIL_TOKENS = 85
+# enough of a base64 payload to reach the size in a JPEG or PNG header, past any EXIF block
+_HEADER_CHARS = 96 * 1024
+
+
+def payload_tokens(url, detail=None):
+    """Estimated tokens of an ``image_url`` data URL, read from the image header; the maximum when unknown."""
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    if not url.startswith("data:"):
+        return MAX_IMAGE_TOKENS
+    from PIL import Image
+
+    encoded = url.partition(",")[2][:_HEADER_CHARS]
+    try:
+        # Image.open only parses the header, so a truncated payload still gives the size
+        with Image.open(io.BytesIO(base64.b64decode(encoded[:len(encoded) // 4 * 4]))) as image:
+            return image_tokens(*image.size)
+    except (OSError, ValueError):
+        return MAX_IMAGE_TOKENS
+
+
+def _downscale(data, max_side, quality):
+    """Return (jpeg bytes, width, height, original width, original height); sizes are None if unreadable."""
+    # Pillow is only needed once images are resized
+    from PIL import Image, ImageOps
+
+    try:
+        # Image.open only reads the header, so truncated or corrupt pixel data fails further on
+        with Image.open(io.BytesIO(data)) as image:
+            original_size = image.size
+            # re-encoding drops the EXIF orientation, so it is applied to the pixels first
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+    except OSError:
+        return data, None, None, None, None
+    resized = image.size != original_size
+    if not resized and len(output.getvalue()) >= len(data):
+        return data, original_size[0], original_size[1], original_size[0], original_size[1]
+    return output.getvalue(), image.size[0], image.size[1], original_size[0], original_size[1]
+
+
+class ImageCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS payloads ("
+            "file_hash TEXT NOT NULL, max_side INTEGER NOT NULL, quality INTEGER NOT NULL, "
+            "payload TEXT NOT NULL, width INTEGER, height INTEGER, original_width INTEGER, original_height INTEGER, "
+            "PRIMARY KEY (file_hash, max_side, quality))"
+        )
+        self._conn.commit()
+
+    def get(self, digest, max_side, quality):
+        """Return (payload, width, height, original width, original height) or None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT payload, width, height, original_width, original_height FROM payloads "
+                "WHERE file_hash = ? AND max_side = ? AND quality = ?",
+                (digest, max_side, quality),
+            ).fetchone()
+
+    def put(self, digest, max_side, quality, payload, width, height, original_width, original_height):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, max_side, quality, payload, width, height, original_width, original_height),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_cache():
+    """Return the process-wide payload cache, or None when it is disabled."""
+    global _cache
+    if os.environ.get("IMAGE_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        _cache = ImageCache(os.environ.get("IMAGE_CACHE_PATH", DEFAULT_CACHE_PATH))
+    return _cache
+
+
+def default_max_side():
+    return int(os.environ.get("IMAGE_MAX_SIDE", DEFAULT_MAX_SIDE))
+
+
+def default_quality():
+    return int(os.environ.get("IMAGE_QUALITY", DEFAULT_QUALITY))
+
+
+class ImageStats:
+    """Bytes and estimated image tokens of the payloads prepared, against the original files."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.cache_hits = 0
+        self.original_bytes = 0
+        self.payload_bytes = 0
+        self.original_tokens = 0
+        self.payload_tokens = 0
+
+    def record(self, original_bytes, payload_bytes, original_size, size, cache_hit):
+        with self._lock:
+            self.images += 1
+            self.cache_hits += cache_hit
+            self.original_bytes += original_bytes
+            self.payload_bytes += payload_bytes
+            if None not in original_size:
+                self.original_tokens += image_tokens(*original_size)
+                self.payload_tokens += image_tokens(*size)
+
+    def __str__(self):
+        saved = 1 - self.payload_bytes / self.original_bytes if self.original_bytes else 0.0
+        return (
+            f"{self.images} images ({self.cache_hits} cached), {self.original_bytes / 1e6:.1f} MB -> "
+            f"{self.payload_bytes / 1e6:.1f} MB ({saved:.1%} saved), "
+            f"~{self.original_tokens} -> ~{self.payload_tokens} image tokens"
+        )
+
+
+stats = ImageStats()
+
+
+def encode_image(image_path, max_side=None, quality=None):
+    """Base64 JPEG payload of the image at ``image_path``, at most ``max_side`` pixels on its longer side."""
+    max_side = default_max_side() if max_side is None else max_side
+    quality = default_quality() if quality is None else quality
+    with open(image_path, "rb") as image_file:
+        data = image_file.read()
+    if max_side <= 0:
+        return base64.b64encode(data).decode("utf-8")
+
+    cache = get_cache()
+    digest = hashlib.sha256(data).hexdigest()
+    cached = cache.get(digest, max_side, quality) if cache is not None else None
+    if cached is not None:
+        payload, width, height, original_width, original_height = cached
+    else:
+        jpeg, width, height, original_width, original_height = _downscale(data, max_side, quality)
+        payload = base64.b64encode(jpeg).decode("utf-8")
+        if cache is not None:
+            cache.put(digest, max_side, quality, payload, width, height, original_width, original_height)
+    # base64 is 4 bytes for every 3, for the original as for the payload
+    stats.record(4 * math.ceil(len(data) / 3), len(payload), (original_width, original_height), (width, height),
+                 cached is not None)
+    return payload
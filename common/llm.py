@@ -0,0 +1,191 @@
+"""Single entry point for the chat completion calls made by every stage.
+
+Scripts call ``acreate(client, **request)`` (or ``create`` with a synchronous
+client) instead of ``client.chat.completions.create(**request)``. Seeded
+requests are answered from the shared on-disk cache when possible; the rest
+go through the shared rate limiter, which also owns retries of throttled and
+failed calls.
+
+Passing a ``TokenUsage`` as ``usage=`` adds the tokens billed for the call to
+it, with the input split into the part served from the provider's prompt
+cache and the part prefilled from scratch. The provider caches the longest
+previously seen prefix of a prompt, so requests should put what stays fixed
+across calls (instructions, document content, earlier turns) first. Responses
+served from the on-disk cache cost nothing and are not counted.
+
+Every call is also recorded by ``common.telemetry`` (tokens, latency, retries).
+
+Environment variables:
+    LLM_CACHE         set to 0 to disable the response cache
+    LLM_CACHE_PATH    location of the SQLite cache file
+    LLM_CACHE_MAX_MB  size budget of the cache before LRU eviction
+    LLM_RATE_LIMITS   JSON overrides of the per-model rpm/tpm/max_concurrency limits
+"""
+import atexit
+import json
+import os
+import time
+
+from openai.types.chat import ChatCompletion
+
+from common import telemetry
+from common.llm_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, LLMCache, request_key
+from common.rate_limiter import estimate_tokens, limiter_from_env
+
+_cache = None
+_limiter = None
+
+
+def get_cache():
+    """Return the process-wide response cache, or None when it is disabled."""
+    global _cache
+    if os.environ.get("LLM_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        max_mb = os.environ.get("LLM_CACHE_MAX_MB")
+        _cache = LLMCache(
+            os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            int(max_mb) * 1024 ** 2 if max_mb else DEFAULT_MAX_BYTES,
+        )
+        atexit.register(_report_cache_stats)
+    return _cache
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter shared by every call in this process."""
+    global _limiter
+    if _limiter is None:
+        _limiter = limiter_from_env()
+    return _limiter
+
+
+def _report_cache_stats():
+    stats = _cache.stats()
+    if stats["hits"] or stats["misses"]:
+        print(
+            f"LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, "
+            f"{stats['bytes'] / 1024 ** 2:.1f} MB"
+        )
+
+
+def _lookup(request, cache):
+    # Unseeded requests are sampled afresh on every call and the retry loops rely on
+    # that, so they are only cached when the caller asks for it explicitly.
+    if cache is None:
+        cache = request.get("seed") is not None
+    store = get_cache() if cache else None
+    if store is None:
+        return None, None
+    key = request_key(request)
+    cached = store.get(key)
+    if cached is not None:
+        return key, ChatCompletion.construct(**json.loads(cached))
+    return key, None
+
+
+def _store(key, response):
+    if key is not None:
+        get_cache().put(key, response.model_dump_json())
+
+
+def cached_response(request):
+    """Return the cached response for a request, or None if it has not been seen."""
+    _, response = _lookup(request, None)
+    return response
+
+
+def store_response(request, body):
+    """Cache a response body obtained outside ``acreate``/``create`` (e.g. from a batch)."""
+    store = get_cache()
+    if store is not None and request.get("seed") is not None:
+        store.put(request_key(request), json.dumps(body))
+
+
+class TokenUsage:
+    """Running totals of the tokens billed for the API calls it is passed to."""
+
+    def __init__(self):
+        self.api_requests = 0
+        self.cached_input_tokens = 0
+        self.uncached_input_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, response):
+        usage = response.usage
+        self.api_requests += 1
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.cached_input_tokens += cached
+        self.uncached_input_tokens += usage.prompt_tokens - cached
+        self.output_tokens += usage.completion_tokens
+
+    def update(self, other):
+        for name, value in other.as_dict().items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            "api_requests": self.api_requests,
+            "cached_input_tokens": self.cached_input_tokens,
+            "uncached_input_tokens": self.uncached_input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+    def __str__(self):
+        input_tokens = self.cached_input_tokens + self.uncached_input_tokens
+        cached_share = self.cached_input_tokens / input_tokens if input_tokens else 0.0
+        return (
+            f"{self.api_requests} API requests, {input_tokens} input tokens "
+            f"({self.cached_input_tokens} cached, {self.uncached_input_tokens} uncached, "
+            f"{cached_share:.1%} cached), {self.output_tokens} output tokens"
+        )
+
+
+async def acreate(client, cache=None, usage=None, **request):
+    """Cached ``client.chat.completions.create`` for an ``AsyncOpenAI`` client."""
+    key, response = _lookup(request, cache)
+    if response is not None:
+        telemetry.record("cache_hit", request, response)
+        return response
+    start = time.perf_counter()
+    try:
+        # the limiter owns retries, so the client's own retry loop is switched off
+        response, retries = await get_rate_limiter().acall(
+            request["model"],
+            estimate_tokens(request),
+            lambda: client.with_options(max_retries=0).chat.completions.create(**request),
+        )
+    except Exception:
+        telemetry.record("error", request, latency=time.perf_counter() - start)
+        raise
+    telemetry.record("call", request, response, time.perf_counter() - start, retries)
+    if usage is not None:
+        usage.add(response)
+    _store(key, response)
+    return response
+
+
+def create(client, cache=None, usage=None, **request):
+    """Cached ``client.chat.completions.create`` for a synchronous ``OpenAI`` client."""
+    key, response = _lookup(request, cache)
+    if response is not None:
+        telemetry.record("cache_hit", request, response)
+        return response
+    start = time.perf_counter()
+    try:
+        response, retries = get_rate_limiter().call(
+            request["model"],
+            estimate_tokens(request),
+            lambda: client.with_options(max_retries=0).chat.completions.create(**request),
+        )
+    except Exception:
+        telemetry.record("error", request, latency=time.perf_counter() - start)
+        raise
+    telemetry.record("call", request, response, time.perf_counter() - start, retries)
+    if usage is not None:
+        usage.add(response)
+    _store(key, response)
+    return response
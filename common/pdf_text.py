@@ -0,0 +1,275 @@
+"""Text extraction from PDFs with a persistent cache shared by every stage.
+
+``extract_text_from_pdf`` returns the first ``max_chars`` characters of a
+PDF's text, laying out pages only until that many characters are collected.
+A file whose stream ends early (pdfminer's ``PSEOF``) yields the text read
+up to that point. Results are cached in a SQLite file keyed by the hash of
+the PDF's bytes, the char limit and the backend, so each paper is parsed once
+per corpus no matter how many stages and sweep runs read it.
+``extract_texts`` does the same for many files at once across a process pool,
+created on first use and shared by every later call in the process.
+
+Backends:
+    pdfplumber  pdfplumber's page.extract_text(), the reference output
+    pdfminer    pdfminer's interpreter with a text-only device: characters are
+                joined in content-stream order with spaces and newlines placed
+                from glyph positions, skipping layout analysis entirely
+    pypdf2      PyPDF2's extract_text(), used by plot.py
+
+Environment variables:
+    PDF_TEXT_BACKEND     backend used when none is passed (default pdfplumber)
+    PDF_TEXT_CACHE       set to 0 to disable the cache
+    PDF_TEXT_CACHE_PATH  location of the SQLite cache file
+    PDF_TEXT_WORKERS     size of the process pool (default: the CPU count)
+"""
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+import PyPDF2
+from pdfminer.pdfdevice import PDFTextDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.psparser import PSEOF
+from pdfminer.utils import apply_matrix_pt
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "pdf_text.sqlite")
+DEFAULT_MAX_CHARS = 1500
+
+_cache = None
+_hashes = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _is_truncated(error):
+    # newer pdfplumber versions wrap the PSEOF raised while opening a file in their own exception
+    return isinstance(error, PSEOF) or isinstance(error.__context__, PSEOF)
+
+
+def _pdfplumber_text(filepath, max_chars):
+    text = ""
+    try:
+        with pdfplumber.open(filepath) as pdf:
+            for page in pdf.pages:
+                text += page.extract_text()
+                if len(text) >= max_chars:
+                    break
+    except Exception as error:
+        if not _is_truncated(error):
+            raise
+        return text[:max_chars], True
+    return text[:max_chars], False
+
+
+class _PlainTextDevice(PDFTextDevice):
+    """Collects characters as the interpreter draws them, without building layout objects."""
+
+    def __init__(self, rsrcmgr):
+        super().__init__(rsrcmgr)
+        self.parts = []
+        self._previous = None  # (end x, baseline y, glyph height) of the last character
+
+    def begin_page(self, page, ctm):
+        super().begin_page(page, ctm)
+        self._previous = None
+
+    def end_page(self, page):
+        self.parts.append("\n")
+
+    def render_char(self, matrix, font, fontsize, scaling, rise, cid, ncs, graphicstate):
+        try:
+            text = font.to_unichr(cid)
+        except PDFUnicodeNotDefined:
+            text = ""
+        adv = font.char_width(cid) * fontsize * scaling
+        x, y = apply_matrix_pt(matrix, (0, rise))
+        end_x, _ = apply_matrix_pt(matrix, (adv, rise))
+        height = abs(apply_matrix_pt(matrix, (0, rise + fontsize))[1] - y) or fontsize
+        if self._previous is not None and text and not text.isspace():
+            previous_x, previous_y, previous_height = self._previous
+            if abs(y - previous_y) > max(height, previous_height) / 2:
+                self.parts.append("\n")
+            elif x - previous_x > height * 0.15 and self.parts and not self.parts[-1].isspace():
+                self.parts.append(" ")
+        self.parts.append(text)
+        self._previous = (end_x, y, height)
+        return adv
+
+
+def _pdfminer_text(filepath, max_chars):
+    text = ""
+    truncated = False
+    with open(filepath, "rb") as file:
+        rsrcmgr = PDFResourceManager(caching=True)
+        device = _PlainTextDevice(rsrcmgr)
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        try:
+            # pages are parsed lazily, so the ones past the char limit are never read
+            for page in PDFPage.get_pages(file):
+                interpreter.process_page(page)
+                text = "".join(device.parts)
+                if len(text) >= max_chars:
+                    break
+        except PSEOF:
+            text = "".join(device.parts)
+            truncated = True
+    return text[:max_chars], truncated
+
+
+def _pypdf2_text(filepath, max_chars):
+    text = ""
+    with open(filepath, "rb") as file:
+        pdf = PyPDF2.PdfReader(file)
+        for page in pdf.pages:
+            text += page.extract_text()
+            if len(text) >= max_chars:
+                break
+    return text[:max_chars], False
+
+
+BACKENDS = {
+    "pdfplumber": _pdfplumber_text,
+    "pdfminer": _pdfminer_text,
+    "pypdf2": _pypdf2_text,
+}
+
+
+def file_hash(filepath):
+    """sha256 of the file's bytes, remembered for as long as the file is unmodified."""
+    stat = os.stat(filepath)
+    memo_key = (os.path.realpath(filepath), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hashes:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        _hashes[memo_key] = digest.hexdigest()
+    return _hashes[memo_key]
+
+
+class PDFTextCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS texts ("
+            "file_hash TEXT NOT NULL, max_chars INTEGER NOT NULL, backend TEXT NOT NULL, "
+            "text TEXT NOT NULL, truncated INTEGER NOT NULL, "
+            "PRIMARY KEY (file_hash, max_chars, backend))"
+        )
+        self._conn.commit()
+
+    def get(self, digest, max_chars, backend):
+        """Return (text, truncated) or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, truncated FROM texts WHERE file_hash = ? AND max_chars = ? AND backend = ?",
+                (digest, max_chars, backend),
+            ).fetchone()
+        return None if row is None else (row[0], bool(row[1]))
+
+    def put(self, digest, max_chars, backend, text, truncated):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?)",
+                (digest, max_chars, backend, text, int(truncated)),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_cache():
+    """Return the process-wide text cache, or None when it is disabled."""
+    global _cache
+    if os.environ.get("PDF_TEXT_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        _cache = PDFTextCache(os.environ.get("PDF_TEXT_CACHE_PATH", DEFAULT_CACHE_PATH))
+    return _cache
+
+
+def default_backend():
+    return os.environ.get("PDF_TEXT_BACKEND", "pdfplumber")
+
+
+def extract_text_from_pdf(filepath, max_chars=DEFAULT_MAX_CHARS, backend=None, verbose=False):
+    """Return the first ``max_chars`` characters of text in the PDF at ``filepath``.
+
+    With ``verbose``, a note is printed for files that end unexpectedly.
+    """
+    backend = backend or default_backend()
+    cache = get_cache()
+    digest = file_hash(filepath) if cache is not None else None
+    cached = cache.get(digest, max_chars, backend) if cache is not None else None
+    if cached is not None:
+        text, truncated = cached
+    else:
+        text, truncated = BACKENDS[backend](filepath, max_chars)
+        if cache is not None:
+            cache.put(digest, max_chars, backend, text, truncated)
+    if truncated and verbose:
+        print(f"Encountered Unexpected EOF error for {filepath}, extracting available text")
+    return text
+
+
+def get_pool(max_workers=None):
+    """Return the process-wide extraction pool; ``max_workers`` only applies to the call that creates it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = max_workers or int(os.environ.get("PDF_TEXT_WORKERS", 0)) or os.cpu_count()
+            # the pool is started from loader threads while torch and asyncio threads run, and forking
+            # a process with threads can deadlock the child, so workers are spawned fresh instead
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _extract_uncached(args):
+    filepath, max_chars, backend = args
+    return BACKENDS[backend](filepath, max_chars)
+
+
+def extract_texts(filepaths, max_chars=DEFAULT_MAX_CHARS, backend=None, max_workers=None):
+    """Extract many PDFs at once, parsing the ones missing from the cache in a process pool.
+
+    Returns ``{filepath: text}``. Workers only parse; results are written to the
+    cache from this process.
+    """
+    backend = backend or default_backend()
+    cache = get_cache()
+    texts = {}
+    missing = []
+    for filepath in filepaths:
+        cached = cache.get(file_hash(filepath), max_chars, backend) if cache is not None else None
+        if cached is not None:
+            texts[filepath] = cached[0]
+        else:
+            missing.append(filepath)
+    if not missing:
+        return texts
+
+    jobs = [(filepath, max_chars, backend) for filepath in missing]
+    if max_workers == 1:
+        _store_results(cache, texts, jobs, map(_extract_uncached, jobs))
+    else:
+        _store_results(cache, texts, jobs, get_pool(max_workers).map(_extract_uncached, jobs, chunksize=4))
+    return texts
+
+
+def _store_results(cache, texts, jobs, results):
+    for (filepath, max_chars, backend), (text, truncated) in zip(jobs, results):
+        texts[filepath] = text
+        if cache is not None:
+            cache.put(file_hash(filepath), max_chars, backend, text, truncated)
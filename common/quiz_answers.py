@@ -0,0 +1,192 @@
+"""Reading multiple-choice answers out of quiz responses.
+
+Three answer formats are supported, selected with ``--answer-format`` in the
+quiz runners and dynamic.py:
+
+    regex       the reply must be a line of letters or a numbered list, matched
+                by the three patterns the runners have always used; anything
+                else is re-asked
+    tolerant    the same patterns first, then near misses are recovered: JSON,
+                "Question 3: B", "3 - B) text", "Answer: C" lines and lists of
+                letters separated by commas or spaces
+    structured  the request forces a ``submit_answers`` function call whose
+                arguments have one A-D field per question, so the reply has
+                the right length by construction; text replies are still read
+                tolerantly
+
+``AnswerStats`` counts attempts per quiz so the runners can report their
+retry rate for the format used.
+"""
+import json
+import re
+
+ANSWER_FORMATS = ("regex", "tolerant", "structured")
+CHOICES = "ABCD"
+TOOL_NAME = "submit_answers"
+
+continuous_pattern = re.compile(r"^[A-D]+$", re.MULTILINE)
+listed_pattern = re.compile(r"^\d+\)\s*([A-D])\s*$", re.MULTILINE)
+dot_pattern = re.compile(r"^\d+\.\s*([A-D])\s*$", re.MULTILINE)
+# only the words are matched in any case; a lowercase letter is prose ("1. a cat"), not an answer
+numbered_pattern = re.compile(
+    r"^[\s*_#>-]*(?i:question|q)?\s*(\d+)\s*[\).:\-]*\s*[*_]*\s*(?:(?i:answer)\s*[:\-]?\s*)?\(?([A-D])(?![A-Za-z])",
+    re.MULTILINE,
+)
+answer_pattern = re.compile(r"(?i:answer)\s*(?i:is)?\s*[:\-]?\s*\(?([A-D])(?![A-Za-z])")
+letter_run_pattern = re.compile(r"(?<![A-Za-z])([A-D](?:[\s,;/|]*[A-D])*)(?![A-Za-z])")
+
+
+def parse_strict(raw_answers, expected_answers):
+    """The runners' original parser: a line of letters, or exactly ``expected_answers`` numbered lines."""
+    continuous_match = continuous_pattern.search(raw_answers)
+    if continuous_match:
+        return continuous_match.group()
+    # Combine listed and dot patterns
+    listed_matches = listed_pattern.findall(raw_answers) + dot_pattern.findall(raw_answers)
+    if len(listed_matches) == expected_answers:
+        return "".join(match.strip() for match in listed_matches)
+    return None
+
+
+def _from_json(raw_answers, expected_answers):
+    for start, end in (("{", "}"), ("[", "]")):
+        left, right = raw_answers.find(start), raw_answers.rfind(end)
+        if left == -1 or right <= left:
+            continue
+        try:
+            value = json.loads(raw_answers[left:right + 1])
+        except json.JSONDecodeError:
+            continue
+        letters = answers_from_value(value, expected_answers)
+        if letters:
+            return letters
+    return None
+
+
+def answers_from_value(value, expected_answers):
+    """Letters from a decoded ``submit_answers`` payload, a list, or a {number: letter} object."""
+    if isinstance(value, dict):
+        if "answers" in value:
+            return answers_from_value(value["answers"], expected_answers)
+        try:
+            items = sorted(value.items(), key=lambda item: int(re.sub(r"\D", "", str(item[0])) or -1))
+        except ValueError:
+            return None
+        value = [letter for _, letter in items]
+    if isinstance(value, str):
+        value = list(value)
+    if not isinstance(value, list) or len(value) != expected_answers:
+        return None
+    letters = [str(letter).strip().upper()[:1] for letter in value]
+    return "".join(letters) if all(letter and letter in CHOICES for letter in letters) else None
+
+
+def _from_numbered_lines(raw_answers, expected_answers):
+    by_number = {}
+    for number, letter in numbered_pattern.findall(raw_answers):
+        by_number.setdefault(int(number), letter)
+    if set(range(1, expected_answers + 1)) <= set(by_number):
+        return "".join(by_number[number] for number in range(1, expected_answers + 1))
+    return None
+
+
+def _from_answer_lines(raw_answers, expected_answers):
+    letters = answer_pattern.findall(raw_answers)
+    return "".join(letters) if len(letters) == expected_answers else None
+
+
+def _from_letter_run(raw_answers, expected_answers):
+    runs = [re.sub(r"[^A-D]", "", run) for run in letter_run_pattern.findall(raw_answers)]
+    runs = [run for run in runs if len(run) == expected_answers]
+    # more than one candidate run means we would be guessing which one is the answer
+    return runs[0] if len(runs) == 1 else None
+
+
+def parse_text(raw_answers, expected_answers, tolerant=False):
+    """Answers in a text reply, or None. Strict patterns win; the tolerant ones only fill in their misses.
+
+    >>> parse_text("Question 1: B\\nQuestion 2: D) Paris\\nQ3 - A", 3, tolerant=True)
+    'BDA'
+    >>> parse_text("1. a cat sat\\n2. a dog\\n3. b\\n", 3, tolerant=True) is None
+    True
+    """
+    strict = parse_strict(raw_answers, expected_answers)
+    if strict or not tolerant:
+        return strict
+    for recover in (_from_json, _from_numbered_lines, _from_answer_lines, _from_letter_run):
+        letters = recover(raw_answers, expected_answers)
+        if letters:
+            return letters
+    return None
+
+
+def answer_tool(expected_answers):
+    properties = {str(number): {"type": "string", "enum": list(CHOICES)} for number in range(1, expected_answers + 1)}
+    return {
+        "type": "function",
+        "function": {
+            "name": TOOL_NAME,
+            "description": f"Submit the answer (A, B, C or D) to each of the {expected_answers} questions, keyed by question number.",
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def with_answer_tool(request, expected_answers):
+    """``request`` with the answer function attached and forced."""
+    return dict(
+        request,
+        tools=[answer_tool(expected_answers)],
+        tool_choice={"type": "function", "function": {"name": TOOL_NAME}},
+    )
+
+
+def prepare_request(request, expected_answers, answer_format):
+    return with_answer_tool(request, expected_answers) if answer_format == "structured" else request
+
+
+def parse_response(response, expected_answers, answer_format="regex"):
+    """Answers in a chat completion for the given format, or None."""
+    message = response.choices[0].message
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        if tool_call.function.name == TOOL_NAME:
+            try:
+                letters = answers_from_value(json.loads(tool_call.function.arguments), expected_answers)
+            except json.JSONDecodeError:
+                letters = _from_json(tool_call.function.arguments, expected_answers)
+            if letters:
+                return letters
+    return parse_text((message.content or "").strip(), expected_answers, tolerant=answer_format != "regex")
+
+
+class AnswerStats:
+    """Attempts needed per quiz, to compare the retry rate of the answer formats."""
+
+    def __init__(self):
+        self.quizzes = 0
+        self.attempts = 0
+        self.unanswered = 0
+
+    def record(self, attempts, answered):
+        self.quizzes += 1
+        self.attempts += attempts
+        self.unanswered += not answered
+
+    @property
+    def retry_rate(self):
+        """Share of calls that were re-asks."""
+        return (self.attempts - self.quizzes) / self.attempts if self.attempts else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.quizzes} quizzes, {self.attempts} calls, {self.attempts - self.quizzes} retries "
+            f"({self.retry_rate:.1%} of calls), {self.unanswered} unanswered"
+        )
+
+
+stats = AnswerStats()
@@ -0,0 +1,208 @@
+"""Per-model request and token rate limiting for chat completion calls.
+
+Each model gets a requests-per-minute and a tokens-per-minute token bucket
+plus an adaptive concurrency cap. The cap grows by one slot per window of
+successful calls and halves whenever the API answers 429 or 5xx (AIMD), so
+the stages settle just under the account's real limits instead of flooding
+the API. Throttled calls wait for the server's Retry-After when it sends one
+and otherwise back off exponentially with full jitter; while a model is
+backing off, no other request to it is started.
+
+Limits can be overridden with the LLM_RATE_LIMITS environment variable, e.g.
+``{"gpt-4o": {"rpm": 500, "tpm": 30000, "max_concurrency": 16}}``.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import openai
+
+from common.images import payload_tokens
+
+DEFAULT_LIMITS = {
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 160000, "max_concurrency": 64},
+    "gpt-4o": {"rpm": 500, "tpm": 30000, "max_concurrency": 16},
+}
+FALLBACK_LIMITS = {"rpm": 500, "tpm": 30000, "max_concurrency": 16}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Continuously refilling bucket; reservations may overdraw and report the wait."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount):
+        """Take ``amount`` tokens and return how long to wait before using them."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _ModelState:
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits["rpm"])
+        self.tokens = TokenBucket(limits["tpm"])
+        self.max_concurrency = limits["max_concurrency"]
+        self.concurrency = float(limits["max_concurrency"])
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+
+
+def _is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def _count_content(content):
+    """(characters of text, image tokens) in a message's content."""
+    if not isinstance(content, list):
+        return len(json.dumps(content, ensure_ascii=False)), 0
+    chars = images = 0
+    for part in content:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            # the base64 data would count as ~100k text tokens; images are billed per tile instead
+            image_url = part.get("image_url") or {}
+            images += payload_tokens(image_url.get("url", ""), image_url.get("detail"))
+        else:
+            chars += len(json.dumps(part, ensure_ascii=False))
+    return chars, images
+
+
+def estimate_tokens(request):
+    """Rough prompt-plus-completion token count used to charge the TPM bucket."""
+    prompt_chars = image_tokens = 0
+    for message in request.get("messages", []):
+        chars, tokens = _count_content(message.get("content"))
+        prompt_chars += chars + len(message.get("role", "")) + 16
+        image_tokens += tokens
+    return prompt_chars // 4 + image_tokens + (request.get("max_tokens") or 512)
+
+
+class RateLimiter:
+    def __init__(self, limits=None, max_attempts=8, base_backoff=1.0, max_backoff=60.0):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._models = {}
+        self._lock = threading.Lock()
+        self._conditions = {}
+
+    def _state(self, model):
+        if model not in self._models:
+            limits = dict(FALLBACK_LIMITS)
+            limits.update(self.limits.get(model, {}))
+            self._models[model] = _ModelState(limits)
+        return self._models[model]
+
+    def set_max_concurrency(self, max_concurrency, model=None):
+        """Cap in-flight requests for one model, or for every model when none is given."""
+        models = [model] if model else set(self.limits) | set(self._models)
+        for name in models:
+            self.limits[name] = dict(self.limits.get(name, FALLBACK_LIMITS), max_concurrency=max_concurrency)
+            if name in self._models:
+                state = self._models[name]
+                state.max_concurrency = max_concurrency
+                state.concurrency = min(state.concurrency, max_concurrency)
+
+    def _backoff(self, attempt, error):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def _on_success(self, state, estimated, usage):
+        state.concurrency = min(state.max_concurrency, state.concurrency + 1 / state.concurrency)
+        if usage is not None and usage.total_tokens is not None:
+            state.tokens.refund(estimated - usage.total_tokens)
+
+    def _on_throttle(self, state, delay):
+        state.concurrency = max(1.0, state.concurrency / 2)
+        state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+        state.throttled += 1
+
+    def _reserve(self, state, estimated):
+        # callers cap ``estimated`` at the bucket's capacity, so no request waits for more than one full refill
+        with self._lock:
+            wait = max(state.requests.reserve(1), state.tokens.reserve(estimated))
+            return max(wait, state.blocked_until - time.monotonic())
+
+    async def acall(self, model, estimated_tokens, make_call):
+        """Await ``make_call()`` within the model's limits; returns (response, retries)."""
+        state = self._state(model)
+        estimated_tokens = min(estimated_tokens, state.tokens.capacity)
+        condition = self._conditions.setdefault(model, asyncio.Condition())
+        for attempt in range(self.max_attempts):
+            async with condition:
+                await condition.wait_for(lambda: state.in_flight < int(state.concurrency))
+                state.in_flight += 1
+            try:
+                await asyncio.sleep(self._reserve(state, estimated_tokens))
+                response = await make_call()
+            except openai.APIError as error:
+                if not _is_retryable(error) or attempt == self.max_attempts - 1:
+                    raise
+                delay = self._backoff(attempt, error)
+                self._on_throttle(state, delay)
+            else:
+                self._on_success(state, estimated_tokens, getattr(response, "usage", None))
+                return response, attempt
+            finally:
+                async with condition:
+                    state.in_flight -= 1
+                    condition.notify_all()
+            await asyncio.sleep(delay)
+
+    def call(self, model, estimated_tokens, make_call):
+        """Blocking counterpart of ``acall`` for synchronous clients."""
+        state = self._state(model)
+        estimated_tokens = min(estimated_tokens, state.tokens.capacity)
+        for attempt in range(self.max_attempts):
+            time.sleep(self._reserve(state, estimated_tokens))
+            try:
+                response = make_call()
+            except openai.APIError as error:
+                if not _is_retryable(error) or attempt == self.max_attempts - 1:
+                    raise
+                delay = self._backoff(attempt, error)
+                self._on_throttle(state, delay)
+                time.sleep(delay)
+            else:
+                self._on_success(state, estimated_tokens, getattr(response, "usage", None))
+                return response, attempt
+
+
+def limiter_from_env():
+    limits = json.loads(os.environ["LLM_RATE_LIMITS"]) if os.environ.get("LLM_RATE_LIMITS") else None
+    return RateLimiter(limits)
@@ -0,0 +1,232 @@
+"""Per-call telemetry for the chat completion calls of every stage.
+
+``llm.acreate``/``llm.create`` record one event per call: the model, the
+prompt (and prompt-cached), completion tokens, the latency, and the number
+of retries the rate limiter needed. Latency includes any time spent waiting
+on the rate limiter. Calls answered from the on-disk response cache are
+recorded as ``cache_hit``, and calls that fail are recorded as ``error``.
+Stages add a ``parse_failure`` event when a response cannot be parsed.
+
+Every event is tagged with the stage (the script name unless set), the
+context, the document and the seed of the request. Tags are set with
+``set_tags`` for the rest of the current task, or with ``tags(...)`` for a
+block. They live in a context variable, so concurrent conversations each
+keep their own document tag. Events are buffered and written in batches to
+a SQLite file.
+
+    python -m common.telemetry --stage s2 dynamic
+
+prints p50/p95 latency, tokens/sec and cost per document for each stage and
+model.
+
+Environment variables:
+    TELEMETRY       set to 0 to disable recording
+    TELEMETRY_PATH  location of the SQLite file
+"""
+import argparse
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "telemetry.sqlite")
+FLUSH_EVERY = 100
+# USD per million tokens: (input, cached input, output)
+PRICES = {
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+COLUMNS = ("ts", "kind", "stage", "context", "document", "seed", "model",
+           "prompt_tokens", "cached_tokens", "completion_tokens", "latency", "retries")
+
+_tags = contextvars.ContextVar("telemetry_tags", default={})
+_store = None
+
+
+class TelemetryStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "ts REAL NOT NULL, kind TEXT NOT NULL, stage TEXT, context TEXT, document TEXT, "
+            "seed INTEGER, model TEXT, prompt_tokens INTEGER, cached_tokens INTEGER, "
+            "completion_tokens INTEGER, latency REAL, retries INTEGER)"
+        )
+        self._conn.commit()
+
+    def add(self, row):
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._conn.executemany(f"INSERT INTO events VALUES ({', '.join('?' * len(COLUMNS))})", self._pending)
+            self._conn.commit()
+            self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def rows(self, stages=None):
+        """All events as dicts, optionally only those of the given stages."""
+        self.flush()
+        query = f"SELECT {', '.join(COLUMNS)} FROM events"
+        params = ()
+        if stages:
+            query += f" WHERE stage IN ({', '.join('?' * len(stages))})"
+            params = tuple(stages)
+        with self._lock:
+            return [dict(zip(COLUMNS, row)) for row in self._conn.execute(query, params)]
+
+
+def get_store():
+    """Return the process-wide telemetry store, or None when recording is disabled."""
+    global _store
+    if os.environ.get("TELEMETRY", "1") == "0":
+        return None
+    if _store is None:
+        _store = TelemetryStore(os.environ.get("TELEMETRY_PATH", DEFAULT_PATH))
+        atexit.register(_store.flush)
+    return _store
+
+
+def set_tags(**tags):
+    """Tag every event recorded from now on in the current context (e.g. ``context=``, ``document=``)."""
+    _tags.set({**_tags.get(), **tags})
+
+
+@contextlib.contextmanager
+def tags(**tags):
+    """Tag the events recorded inside the block."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def _default_stage():
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or None
+
+
+def record(kind, request, response=None, latency=None, retries=None):
+    store = get_store()
+    if store is None:
+        return
+    current = _tags.get()
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    store.add((
+        time.time(), kind, current.get("stage") or _default_stage(), current.get("context"),
+        current.get("document"), current.get("seed", request.get("seed")), request.get("model"),
+        getattr(usage, "prompt_tokens", None), getattr(details, "cached_tokens", None),
+        getattr(usage, "completion_tokens", None), latency, retries,
+    ))
+
+
+def record_parse_failure(model, seed=None):
+    """Note that a response from ``model`` to the request with ``seed`` could not be parsed."""
+    record("parse_failure", {"model": model, "seed": seed})
+
+
+def cost(model, prompt_tokens, cached_tokens, completion_tokens, prices=PRICES):
+    if model not in prices:
+        return None
+    input_price, cached_price, output_price = prices[model]
+    cached_tokens = cached_tokens or 0
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1e6
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def summarize(rows, prices=PRICES):
+    """Aggregate events per (stage, model)."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["stage"], row["model"]), []).append(row)
+    summary = []
+    for (stage, model), events in sorted(groups.items(), key=lambda item: tuple(map(str, item[0]))):
+        calls = [event for event in events if event["kind"] == "call"]
+        latencies = [event["latency"] for event in calls]
+        prompt_tokens = sum(event["prompt_tokens"] or 0 for event in calls)
+        cached_tokens = sum(event["cached_tokens"] or 0 for event in calls)
+        completion_tokens = sum(event["completion_tokens"] or 0 for event in calls)
+        total_cost = cost(model, prompt_tokens, cached_tokens, completion_tokens, prices)
+        documents = {event["document"] for event in calls if event["document"] is not None}
+        summary.append({
+            "stage": stage,
+            "model": model,
+            "calls": len(calls),
+            "cache_hits": sum(event["kind"] == "cache_hit" for event in events),
+            "errors": sum(event["kind"] == "error" for event in events),
+            "retries": sum(event["retries"] or 0 for event in calls),
+            "parse_failures": sum(event["kind"] == "parse_failure" for event in events),
+            "p50_latency": percentile(latencies, 50) if latencies else None,
+            "p95_latency": percentile(latencies, 95) if latencies else None,
+            "tokens_per_sec": completion_tokens / sum(latencies) if latencies and sum(latencies) else None,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": total_cost,
+            "documents": len(documents),
+            "cost_per_document": total_cost / len(documents) if total_cost is not None and documents else None,
+        })
+    return summary
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_summary(summary):
+    header = (f"{'stage':<16} {'model':<14} {'calls':>7} {'hits':>6} {'errors':>6} {'retries':>7} {'parse':>6} "
+              f"{'p50 s':>7} {'p95 s':>7} {'tok/s':>7} {'in tok':>10} {'cached':>10} {'out tok':>9} "
+              f"{'cost $':>9} {'docs':>6} {'$/doc':>8}")
+    print(header)
+    print("-" * len(header))
+    for row in summary:
+        print(f"{str(row['stage']):<16} {str(row['model']):<14} {row['calls']:>7} {row['cache_hits']:>6} "
+              f"{row['errors']:>6} {row['retries']:>7} {row['parse_failures']:>6} "
+              f"{_fmt(row['p50_latency'], '7.2f')} {_fmt(row['p95_latency'], '7.2f')} "
+              f"{_fmt(row['tokens_per_sec'], '7.1f')} {row['prompt_tokens']:>10} {row['cached_tokens']:>10} "
+              f"{row['completion_tokens']:>9} {_fmt(row['cost'], '9.3f')} {row['documents']:>6} "
+              f"{_fmt(row['cost_per_document'], '8.4f')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize recorded LLM call telemetry")
+    parser.add_argument("--stage", nargs="+", default=None, help="Only report these stages")
+    parser.add_argument("--path", default=os.environ.get("TELEMETRY_PATH", DEFAULT_PATH), help="Telemetry SQLite file")
+    parser.add_argument("--prices", default=None,
+                        help='JSON overrides of the USD per 1M token prices, e.g. {"gpt-4o": [2.5, 1.25, 10]}')
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise SystemExit(f"No telemetry recorded at {args.path}")
+    prices = dict(PRICES)
+    if args.prices:
+        prices.update({model: tuple(price) for model, price in json.loads(args.prices).items()})
+    summary = summarize(TelemetryStore(args.path).rows(args.stage), prices)
+    if args.json:
+        print(json.dumps(summary, indent=4))
+    else:
+        print_summary(summary)
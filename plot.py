@@ -9,23 +9,10 @@ import argparse
 import glob
 import tiktoken
 import json
-import PyPDF2
+from common.pdf_text import extract_text_from_pdf
 
 gpt_tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    with open(filepath, "rb") as file:
-        pdf = PyPDF2.PdfReader(file)
-        for page_num in range(len(pdf.pages)):
-            text += pdf.pages[page_num].extract_text()
-            if (
-                len(text) >= 1500
-            ):  # Check if the accumulated text has reached 1500 characters
-                break  # Stop reading further if 1500 characters have been reached
-    return text[:1500]  # Return only the first 1500 characters of the text
-
-
 def preprocess_dynamic_results(results_dir, method_name):
     all_results = []
     contexts = ['academic_papers', 'movie_plots', 'news_articles', 'song_lyrics']
@@ -103,7 +90,7 @@ def plot_lengths(static_lesson_dir, content_dir, plain_results_dir, lesson_resul
                         chat_data = json.load(f)
                         content = ' '.join(list(map(lambda x: x['content'], chat_data)))
                     elif file.endswith('.pdf'):
-                        content = extract_text_from_pdf(file)
+                        content = extract_text_from_pdf(file, backend="pypdf2")
                     else:
                         content = f.read()
                 content_length = _count_tokens(content)
@@ -23,8 +23,6 @@ import random
 import joblib
 import argparse
 from itertools import chain
-import pdfplumber
-from pdfminer.psparser import PSEOF
 import pandas as pd
 from itertools import groupby
 from operator import itemgetter
@@ -118,18 +116,6 @@ class RRegressionScorer(BaseEstimator, TransformerMixin):
     def score(self, X, y):
         return self.scores_
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    try:
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
-                if len(text) >= 1500:
-                    break
-    except PSEOF:  # Catch the PSEOF exception
-        pass  # Continue to the next line
-    return text[:1500]
-
 def prepare_data(content_directories, chat_directories, seed: int = 42):
     dataset = []
 
@@ -0,0 +1,3 @@
+# Every context, subcategory and method of the paper grid in one process.
+# Extra arguments are passed on to the sweep, e.g. scripts/run_sweep.sh --seeds 123 7 42
+python 5-Dynamic/sweep.py --num-turns 5 --data-folder data --root-folder /ssd-playpen/kzaman/student-teacher-interaction --output-root results "$@"